@@ -1,7 +1,13 @@
 # bot.py
 import os
 import sys
+import time
+import asyncio
+import hashlib
 import logging
+import threading
+from concurrent.futures import Future
+from datetime import datetime
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import (
     Application,
@@ -11,35 +17,62 @@ from telegram.ext import (
     ContextTypes,
     ConversationHandler,
     CallbackQueryHandler,
+    TypeHandler,
 )
 
-# --- 🔒 Блокировка повторного запуска ---
-LOCK_FILE = "bot.lock"
-
-if os.path.exists(LOCK_FILE):
-    print("❌ Бот уже запущен или предыдущий процесс не завершился.")
-    print("Удалите файл 'bot.lock', если уверены, что бот не работает.")
-    sys.exit(1)
-
-# Создаём файл блокировки
-with open(LOCK_FILE, "w", encoding="utf-8") as f:
-    f.write(str(os.getpid()))
-
-# Удаляем файл при выходе
-import atexit
-atexit.register(lambda: os.path.exists(LOCK_FILE) and os.remove(LOCK_FILE))
-# ---------------------------------------
+from notifications import AdminNotifier, RateLimiter
+from metrics import (
+    REGISTRY,
+    InstrumentedRequest,
+    start_metrics_server,
+    timed_handler,
+)
+from update_processor import PerUserUpdateProcessor
+from leader import PidFileLock, AdvisoryLeaderLock, wait_for_leadership, watch_leadership
+from persistence import create_persistence, DRAFT_KEYS
+from dedup import RecentSubmissions, normalize_key
+from search_index import SearchIndex
+from local_buffer import LocalBuffer, BufferReplayer
+from brackets import BRACKET_FORMATS, teams_report, bracket_report
+from render import (
+    MAX_MESSAGE_LENGTH,
+    BACK_BUTTON,
+    ADMIN_MENU_TEXT,
+    ADMIN_MENU_KEYBOARD,
+    BACK_KEYBOARD,
+    OPEN_LIST_KEYBOARD,
+    CONFIRM_DELETE_KEYBOARD,
+    CONFIRM_RESET_KEYBOARD,
+    CONFIRM_BROADCAST_KEYBOARD,
+    NOTIFY_KEYBOARD,
+    truncate,
+    render_stats,
+    decode_page_callback,
+    render_list_page,
+    edit_message,
+)
 
 # Попытка импортировать базу данных
 try:
     from database import (
         init_db,
         save_application,
+        save_applications_checked,
+        TRANSIENT_ERRORS,
         get_stats,
+        get_applications_page,
+        get_applications_by_ids,
         get_all_applications,
-        reset_applications,
-        delete_application_by_id,
+        search_applications,
+        close_tournament,
+        delete_applications_by_ids,
+        count_broadcast_recipients,
+        close_pool,
+        run_db,
     )
+    from write_behind import WriteBehindQueue, WRITE_BEHIND_ENABLED
+    from export import export_applications
+    from broadcast import Broadcaster
     DATABASE_AVAILABLE = True
 except ImportError as e:
     DATABASE_AVAILABLE = False
@@ -54,10 +87,44 @@ if not BOT_TOKEN:
 ADMIN_IDS_STR = os.environ.get('ADMIN_IDS', '')
 ADMIN_IDS = [int(x.strip()) for x in ADMIN_IDS_STR.split(',') if x.strip().isdigit()]
 
+# Режим вебхука включается, если задан публичный адрес WEBHOOK_URL
+WEBHOOK_URL = os.environ.get('WEBHOOK_URL', '').rstrip('/')
+WEBHOOK_PATH = os.environ.get('WEBHOOK_PATH', 'telegram')
+WEBHOOK_LISTEN = os.environ.get('WEBHOOK_LISTEN', '0.0.0.0')
+WEBHOOK_PORT = int(os.environ.get('PORT', '8080'))
+# Telegram присылает этот токен в заголовке X-Telegram-Bot-Api-Secret-Token.
+# По умолчанию он выводится из токена бота, чтобы у всех реплик был один и тот же
+WEBHOOK_SECRET = os.environ.get('WEBHOOK_SECRET') or hashlib.sha256(BOT_TOKEN.encode()).hexdigest()
+# Сколько обновлений обрабатывается одновременно (1 - строго по очереди), и в
+# вебхуке, и в polling: иначе один медленный запрос к БД задерживает всех.
+# Апдейты одного пользователя в любом случае идут по очереди
+CONCURRENT_UPDATES = int(os.environ.get('CONCURRENT_UPDATES', '32'))
+
+# Через сколько секунд без ответа незавершённая регистрация сбрасывается
+REGISTRATION_TIMEOUT = int(os.environ.get('REGISTRATION_TIMEOUT', str(24 * 3600)))
+
+# Без базы данных повторный запуск блокируется файлом
+LOCK_FILE = "bot.lock"
+
 # Состояния
 NICKNAME, RANK, NAME, CONTACT, TEAM = range(5)
 WAITING_DELETE_ID, CONFIRM_DELETE = range(100, 102)
 
+# Постраничный список участников
+PAGE_SIZE = 10
+
+# Выгрузка большой таблицы может идти несколько минут
+EXPORT_TIMEOUT = 600
+
+# Сколько живёт снимок "номер -> ID" показанного админу списка
+LIST_SNAPSHOT_TTL = 15 * 60
+# Максимум профилей в одном запросе на удаление
+MAX_BULK_DELETE = 200
+# Сколько результатов показывает /find
+SEARCH_LIMIT = 10
+# Запас под номер страницы в тексте отчётов /teams и /bracket
+REPORT_PAGE_LENGTH = MAX_MESSAGE_LENGTH - 96
+
 # Логирование
 logging.basicConfig(
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
@@ -65,31 +132,219 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Отсчёт времени запуска - от импорта бота до готовности принимать апдейты
+STARTED_AT = time.monotonic()
+# Завершается, когда миграции применены и пул соединений прогрет
+database_ready = None
+
 def initialize_database():
-    if DATABASE_AVAILABLE:
+    """Запуск миграций в фоновом потоке: они идут одновременно с инициализацией бота в PTB"""
+    global database_ready
+    database_ready = Future()
+    if not DATABASE_AVAILABLE:
+        logger.info("⚠️ Работа с базой данных отключена")
+        database_ready.set_result(None)
+        return database_ready
+    threading.Thread(target=_initialize_database, name="db-init", daemon=True).start()
+    return database_ready
+
+def _initialize_database():
+    started = time.monotonic()
+    try:
+        # Заодно открывает первые соединения пула
+        init_db()
+        logger.info(f"✅ База данных инициализирована за {time.monotonic() - started:.2f} с")
+    except Exception as e:
+        logger.error(f"❌ Ошибка инициализации базы данных: {e}")
+    finally:
+        database_ready.set_result(None)
+
+async def post_init(application: Application):
+    # Обработчики и фоновые задачи ниже работают с БД - дожидаемся миграций
+    if database_ready is not None:
+        await asyncio.wrap_future(database_ready)
+
+    # Лидер следит, что блокировка всё ещё за ним
+    lock = application.bot_data.get('leader_lock')
+    if lock:
+        application.bot_data['leader_watch'] = asyncio.create_task(
+            watch_leadership(lock, lambda: lost_leadership(application))
+        )
+
+    # Уведомления админам отправляются в фоне
+    # Один ограничитель на уведомления и рассылки: лимит Telegram общий на бота
+    limiter = RateLimiter()
+    notifier = AdminNotifier(application.bot, ADMIN_IDS, limiter)
+    notifier.start()
+    application.bot_data['notifier'] = notifier
+
+    # Метрики: /metrics и лог медленных обработчиков
+    REGISTRY.gauge('bot_update_queue_depth', 'Апдейты в очереди', application.update_queue.qsize)
+    REGISTRY.gauge('bot_admin_notify_queue_depth', 'Уведомления админам в очереди', lambda: notifier.queue_depth)
+    try:
+        application.bot_data['metrics_server'] = await start_metrics_server()
+    except OSError as e:
+        logger.error(f"❌ Не удалось запустить /metrics: {e}")
+
+    # Отложенная пакетная запись анкет
+    if DATABASE_AVAILABLE and WRITE_BEHIND_ENABLED and CONCURRENT_UPDATES <= 1:
+        # team() ждёт запись, прежде чем возьмётся следующий апдейт: в пачке
+        # всегда одна анкета, и каждая регистрация только дольше ждёт сброса
+        logger.warning("⚠️ WRITE_BEHIND=1 не действует при CONCURRENT_UPDATES=1: анкеты пишутся по одной")
+    elif DATABASE_AVAILABLE and WRITE_BEHIND_ENABLED:
+        writer = WriteBehindQueue()
         try:
-            init_db()
-            logger.info("✅ База данных инициализирована успешно")
+            await writer.start()
+            application.bot_data['writer'] = writer
+            logger.info("✅ Включена пакетная запись анкет")
         except Exception as e:
-            logger.error(f"❌ Ошибка инициализации базы данных: {e}")
-    else:
-        logger.info("⚠️ Работа с базой данных отключена")
+            writer.journal.close()
+            logger.error(f"❌ Не удалось включить пакетную запись: {e}")
 
-# Функция для создания основного админ-меню
-def get_admin_menu_keyboard():
-    return InlineKeyboardMarkup([
-        [InlineKeyboardButton("📊 Статистика", callback_data="stats")],
-        [InlineKeyboardButton("📋 Все участники", callback_data="list_all")],
-        [InlineKeyboardButton("🗑 Удалить профиль", callback_data="delete_profile")],
-        [InlineKeyboardButton("♻️ Сбросить всё", callback_data="reset_all")],
-    ])
+    # Анкеты, не попавшие в БД, ждут в локальном буфере и дописываются в фоне
+    buffer = LocalBuffer()
+    application.bot_data['buffer'] = buffer
+    REGISTRY.gauge('bot_local_buffer_pending', 'Анкеты в локальном буфере', buffer.count)
+    REGISTRY.gauge('bot_local_buffer_rejected', 'Анкеты, отвергнутые БД', buffer.rejected_count)
+    if DATABASE_AVAILABLE:
+        replayer = BufferReplayer(buffer, lambda rows: run_db(save_applications_checked, rows), index_synced)
+        replayer.start()
+        application.bot_data['replayer'] = replayer
+
+    # Рассылки участникам, в том числе незавершённые до перезапуска
+    if DATABASE_AVAILABLE and os.environ.get('DATABASE_URL'):
+        broadcaster = Broadcaster(application.bot, limiter)
+        broadcaster.start()
+        application.bot_data['broadcaster'] = broadcaster
+
+    # Индекс для /find в памяти заполняется в фоне, чтобы не задерживать запуск
+    if DATABASE_AVAILABLE:
+        application.bot_data['search_warmup'] = asyncio.create_task(warm_up_search_index())
+
+    logger.info(f"🚀 Бот готов к работе через {time.monotonic() - STARTED_AT:.2f} с после запуска процесса")
+
+async def warm_up_search_index():
+    try:
+        rows = await run_db(get_all_applications)
+    except Exception as e:
+        logger.error(f"❌ Не удалось заполнить индекс поиска: {e}")
+        return
+    for row in rows:
+        search_index.add(row)
+    logger.info(f"🔎 Индекс поиска: {len(search_index)} анкет")
+
+# Анкеты из локального буфера получили ID в БД - обновляем их в индексе поиска
+def index_synced(rows, app_ids):
+    for row, app_id in zip(rows, app_ids):
+        nickname_val, rank_val, name_val, contact_val, team_val, _, created_at = row
+        search_index.add({
+            'id': app_id, 'nickname': nickname_val, 'rank': rank_val, 'name': name_val,
+            'contact': contact_val, 'team': team_val, 'created_at': created_at.astimezone().replace(tzinfo=None),
+        })
+
+def lost_leadership(application: Application):
+    application.bot_data['leadership_lost'] = True
+    application.stop_running()
+
+async def post_stop(application: Application):
+    for task_name in ('leader_watch', 'search_warmup'):
+        task = application.bot_data.pop(task_name, None)
+        if task:
+            task.cancel()
+    metrics_server = application.bot_data.pop('metrics_server', None)
+    if metrics_server:
+        metrics_server.close()
+    # Дописываем анкеты из очереди
+    writer = application.bot_data.get('writer')
+    if writer:
+        await writer.stop()
+    replayer = application.bot_data.get('replayer')
+    if replayer:
+        await replayer.stop()
+    elif application.bot_data.get('buffer'):
+        application.bot_data['buffer'].close()
+    # Прогресс рассылок сохранён, после перезапуска они продолжатся
+    broadcaster = application.bot_data.get('broadcaster')
+    if broadcaster:
+        await broadcaster.stop()
+    # Дожидаемся отправки уведомлений, пока бот ещё может отправлять сообщения
+    notifier = application.bot_data.get('notifier')
+    if notifier:
+        await notifier.stop()
+
+async def shutdown(application: Application):
+    # Закрываем соединения пула при остановке
+    if DATABASE_AVAILABLE:
+        close_pool()
+
+# Запоминаем, какой ID стоял под каким номером в показанном админу списке.
+# reset - список открыт заново: номера прежних страниц могли сдвинуться
+def remember_list_numbers(context, start_num, apps, reset=False):
+    snapshot = None if reset else get_list_snapshot(context)
+    if snapshot is None:
+        snapshot = {}
+    for i, app in enumerate(apps, start_num):
+        snapshot[i] = app['id']
+    context.user_data['list_snapshot'] = snapshot
+    context.user_data['list_snapshot_expires'] = time.time() + LIST_SNAPSHOT_TTL
+
+def get_list_snapshot(context):
+    if context.user_data.get('list_snapshot_expires', 0) < time.time():
+        return None
+    return context.user_data.get('list_snapshot')
+
+def clear_list_snapshot(context):
+    context.user_data.pop('list_snapshot', None)
+    context.user_data.pop('list_snapshot_expires', None)
+
+def parse_profile_numbers(text):
+    """Разбор ввода вида "3,7,10-15" в отсортированный список номеров"""
+    numbers = set()
+    for part in text.replace(" ", "").split(","):
+        if not part:
+            continue
+        if "-" in part:
+            first, last = (int(x) for x in part.split("-", 1))
+            if first > last:
+                first, last = last, first
+            if last - first >= MAX_BULK_DELETE:
+                raise ValueError("слишком большой диапазон")
+            numbers.update(range(first, last + 1))
+        else:
+            numbers.add(int(part))
+    if not numbers or len(numbers) > MAX_BULK_DELETE:
+        raise ValueError("неверное количество номеров")
+    return sorted(numbers)
+
+# Недавние заявки: повторы отсекаются ещё до запроса к БД
+recent_submissions = RecentSubmissions()
+# Запасной поиск для /find, когда БД нет или она не отвечает
+search_index = SearchIndex()
+
+async def reply_already_registered(update, entry):
+    app_id = entry[0]
+    message = "✅ Ваша заявка уже принята"
+    if app_id:
+        message += f" (ID: #{app_id})"
+    message += ".\nЕсли нужно исправить данные, пройдите регистрацию позже - новая заявка обновит прежнюю."
+    await update.message.reply_text(message)
+
+# Черновик анкеты больше не нужен - убираем его из памяти и хранилища
+def clear_draft(update, context):
+    for key in DRAFT_KEYS:
+        context.user_data.pop(key, None)
 
 # Команда /start
+@timed_handler("start")
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
     if user_id in ADMIN_IDS:
-        reply_markup = get_admin_menu_keyboard()
-        await update.message.reply_text("👑 Админ-панель", reply_markup=reply_markup)
+        await update.message.reply_text(ADMIN_MENU_TEXT, reply_markup=ADMIN_MENU_KEYBOARD)
+        return ConversationHandler.END
+
+    entry = recent_submissions.find(user_id)
+    if entry:
+        await reply_already_registered(update, entry)
         return ConversationHandler.END
 
     await update.message.reply_text(
@@ -100,26 +355,37 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     return NICKNAME
 
 # === ОБРАБОТКА РЕГИСТРАЦИИ ===
+@timed_handler("nickname")
 async def nickname(update: Update, context: ContextTypes.DEFAULT_TYPE):
     context.user_data['nickname'] = update.message.text
     await update.message.reply_text("2. Какое у вас рейнтинг премьера/общий ранг?")
     return RANK
 
+@timed_handler("rank")
 async def rank(update: Update, context: ContextTypes.DEFAULT_TYPE):
     context.user_data['rank'] = update.message.text
     await update.message.reply_text("3. Ваше имя (не обязательно):")
     return NAME
 
+@timed_handler("name")
 async def name(update: Update, context: ContextTypes.DEFAULT_TYPE):
     context.user_data['name'] = update.message.text
     await update.message.reply_text("4. Способ связи отправьте ссылкой (Telegram, Discord и т.д.):")
     return CONTACT
 
+@timed_handler("contact")
 async def contact(update: Update, context: ContextTypes.DEFAULT_TYPE):
     context.user_data['contact'] = update.message.text
+    # Тот же ник и контакт недавно уже регистрировались
+    entry = recent_submissions.find(normalize_key(context.user_data.get('nickname'), update.message.text))
+    if entry:
+        clear_draft(update, context)
+        await reply_already_registered(update, entry)
+        return ConversationHandler.END
     await update.message.reply_text("5. есть ли команда или расскажите о себе (или просто напишите 'Нет'):")
     return TEAM
 
+@timed_handler("team")
 async def team(update: Update, context: ContextTypes.DEFAULT_TYPE):
     context.user_data['team'] = update.message.text
     nickname_val = context.user_data.get('nickname', 'Не указан')
@@ -127,193 +393,221 @@ async def team(update: Update, context: ContextTypes.DEFAULT_TYPE):
     name_val = context.user_data.get('name', 'Не указан')
     contact_val = context.user_data.get('contact', 'Не указан')
     team_val = context.user_data.get('team', 'Не указан')
+    # Чат пользователя нужен для рассылок
+    chat_id = update.effective_chat.id
 
     app_id = None
+    rejected = False
     if DATABASE_AVAILABLE:
         try:
-            app_id = save_application(nickname_val, rank_val, name_val, contact_val, team_val)
+            writer = context.bot_data.get('writer')
+            if writer:
+                app_id = await writer.save(nickname_val, rank_val, name_val, contact_val, team_val, chat_id)
+            else:
+                app_id = await run_db(save_application, nickname_val, rank_val, name_val, contact_val, team_val, chat_id)
+        except TRANSIENT_ERRORS as e:
+            logger.error(f"БД недоступна, анкета сохраняется локально: {e}")
         except Exception as e:
+            # Ошибка в данных: повтор из буфера упал бы так же, анкета остаётся только в уведомлении админам
             logger.error(f"Ошибка сохранения в БД: {e}")
+            rejected = True
+    buffered = False
+    if app_id is None and not rejected:
+        # БД нет или она не ответила - анкета не теряется, а ждёт в локальном буфере
+        try:
+            await asyncio.to_thread(
+                context.bot_data['buffer'].add, nickname_val, rank_val, name_val, contact_val, team_val, chat_id
+            )
+            buffered = True
+        except Exception as e:
+            logger.error(f"Ошибка записи в локальный буфер: {e}")
+    if not rejected:
+        # Отклонённой БД заявки нет нигде, кроме уведомления: повторная регистрация ей не дубль
+        recent_submissions.remember(app_id, update.effective_user.id, normalize_key(nickname_val, contact_val))
+        search_index.add({
+            'id': app_id, 'nickname': nickname_val, 'rank': rank_val, 'name': name_val,
+            'contact': contact_val, 'team': team_val, 'created_at': datetime.now(),
+        })
 
     form_text = f"🎮 Новая заявка!\n"
     if app_id:
         form_text += f"ID: #{app_id}\n"
+    elif buffered:
+        form_text += "⏳ БД недоступна, заявка сохранена локально и будет записана позже\n"
+    elif rejected:
+        form_text += "❌ БД не приняла заявку, она есть только в этом сообщении\n"
     form_text += (
         f"Ник: {nickname_val}\nРанг: {rank_val}\nИмя: {name_val}\n"
         f"Связь: {contact_val}\nКоманда: {team_val}"
     )
 
-    # Отправляем админам с кнопкой перехода в меню
-    keyboard = [
-        [InlineKeyboardButton("⚙️ Админ-меню", callback_data="back_to_admin_menu")]
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-
-    for admin_id in ADMIN_IDS:
-        try:
-            await context.bot.send_message(chat_id=admin_id, text=form_text, reply_markup=reply_markup)
-        except Exception as e:
-            logger.error(f"Ошибка отправки админу {admin_id}: {e}")
-
     # <<< Изменённое сообщение пользователю
+    # Сначала отвечаем пользователю, админам уведомление уходит в фоне
     response = "✅ Заявка отправлена!\n"
     if app_id:
         response += f"Ваш ID: #{app_id}\n"
     response += "С вами свяжутся по указанному контакту. Ожидайте ответ в ближаешее время."
     await update.message.reply_text(response)
+
+    # Отправляем админам с кнопкой перехода в меню
+    # Поля анкеты не ограничены по длине, а Telegram не примет сообщение длиннее лимита
+    context.bot_data['notifier'].notify(form_text[:MAX_MESSAGE_LENGTH], NOTIFY_KEYBOARD)
+    clear_draft(update, context)
     return ConversationHandler.END
 
+# Пользователь бросил регистрацию: диалог и черновик не должны жить вечно
+@timed_handler("registration_timeout")
+async def registration_timeout(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    clear_draft(update, context)
+    if update.effective_message:
+        await update.effective_message.reply_text("⌛ Регистрация прервана из-за долгого ожидания. Чтобы начать заново, отправьте /start")
+
 # Отмена
+@timed_handler("cancel")
 async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    clear_draft(update, context)
     await update.message.reply_text('Регистрация отменена.')
     return ConversationHandler.END
 
 # === КНОПКИ ДЛЯ АДМИНОВ ===
+@timed_handler("button_handler")
 async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
 
     user_id = query.from_user.id
     if user_id not in ADMIN_IDS:
-        await query.edit_message_text("❌ Доступ запрещён.")
+        await edit_message(query, "❌ Доступ запрещён.")
         return
 
     data = query.data
 
     if data == "stats":
         if not DATABASE_AVAILABLE:
-            keyboard = [[InlineKeyboardButton("⬅️ Назад", callback_data="back_to_admin_menu")]]
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            await query.edit_message_text("❌ База данных недоступна.", reply_markup=reply_markup)
+            await edit_message(query, "❌ База данных недоступна.", reply_markup=BACK_KEYBOARD)
             return
         try:
-            total, teams = get_stats()
-            message = f"📊 Статистика\nВсего: {total}\n"
-            if teams:
-                message += "Команды:\n"
-                for t in teams:
-                    message += f"  {t['team']}: {t['count']}\n"
-            else:
-                message += "Нет команд."
-            keyboard = [[InlineKeyboardButton("⬅️ Назад", callback_data="back_to_admin_menu")]]
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            await query.edit_message_text(message, reply_markup=reply_markup)
+            total, teams = await run_db(get_stats)
+            await edit_message(query, render_stats(total, teams), reply_markup=BACK_KEYBOARD)
         except Exception as e:
             logger.error(f"Ошибка статистики: {e}")
-            keyboard = [[InlineKeyboardButton("⬅️ Назад", callback_data="back_to_admin_menu")]]
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            await query.edit_message_text("❌ Ошибка.", reply_markup=reply_markup)
+            await edit_message(query, "❌ Ошибка.", reply_markup=BACK_KEYBOARD)
 
-    elif data == "list_all":
+    elif data == "list_all" or data.startswith(("list_next:", "list_prev:")):
         if not DATABASE_AVAILABLE:
-            keyboard = [[InlineKeyboardButton("⬅️ Назад", callback_data="back_to_admin_menu")]]
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            await query.edit_message_text("❌ База данных недоступна.", reply_markup=reply_markup)
+            await edit_message(query, "❌ База данных недоступна.", reply_markup=BACK_KEYBOARD)
             return
         try:
-            apps = get_all_applications() # Получаем все записи
-            if not apps:
-                message = "📭 Нет заявок."
+            if data == "list_all":
+                apps, has_next = await run_db(get_applications_page, None, PAGE_SIZE)
+                start_num, has_prev = 1, False
             else:
-                message = "📋 Участники:\n"
-                # Отображаем ID из БД, имя и контакт
-                for i, app in enumerate(apps, 1):
-                    # Показываем ID из БД в скобках для ясности
-                    message += f"{i}. #{app['id']} {app['nickname']} ({app['rank']})\n"
-                    # Добавляем имя и контакт на отдельной строке
-                    name_str = app['name'] if app['name'] else "Не указано"
-                    contact_str = app['contact'] if app['contact'] else "Не указан"
-                    message += f"   Имя: {name_str}, Контакт: {contact_str}\n"
-            keyboard = [[InlineKeyboardButton("⬅️ Назад", callback_data="back_to_admin_menu")]]
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            await query.edit_message_text(message, reply_markup=reply_markup)
+                backward, num, cursor = decode_page_callback(data)
+                apps, has_more = await run_db(get_applications_page, cursor, PAGE_SIZE, backward)
+                if backward:
+                    # num - номер первой записи страницы, с которой ушли назад
+                    start_num = max(1, num - len(apps))
+                    has_prev, has_next = has_more, True
+                else:
+                    start_num = num
+                    has_prev, has_next = True, has_more
+            message, reply_markup = render_list_page(apps, start_num, has_prev and bool(apps), has_next and bool(apps))
+            remember_list_numbers(context, start_num, apps, reset=data == "list_all")
+            await edit_message(query, message, reply_markup=reply_markup)
         except Exception as e:
             logger.error(f"Ошибка списка: {e}")
-            keyboard = [[InlineKeyboardButton("⬅️ Назад", callback_data="back_to_admin_menu")]]
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            await query.edit_message_text("❌ Ошибка.", reply_markup=reply_markup)
+            await edit_message(query, "❌ Ошибка.", reply_markup=BACK_KEYBOARD)
 
     elif data == "delete_profile":
         # Добавляем кнопку "Назад" на экран ввода номера
-        keyboard = [[InlineKeyboardButton("⬅️ Назад", callback_data="back_to_admin_menu")]]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        await query.edit_message_text("Введите номер профиля из списка (номер слева от #ID):", reply_markup=reply_markup)
+        await edit_message(
+            query,
+            "Введите номер профиля из списка (номер слева от #ID).\n"
+            "Можно несколько через запятую и диапазоны: 3,7,10-15",
+            reply_markup=BACK_KEYBOARD
+        )
         context.user_data['awaiting_delete_id'] = True
         # Не возвращаем WAITING_DELETE_ID, так как это CallbackQueryHandler
 
     elif data == "reset_all":
-        keyboard = [
-            [InlineKeyboardButton("✅ Да, сбросить всё", callback_data="confirm_reset")],
-            [InlineKeyboardButton("❌ Нет, отмена", callback_data="cancel_action")],
-            [InlineKeyboardButton("⬅️ Назад", callback_data="back_to_admin_menu")]
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        await query.edit_message_text("⚠️ Внимание! Это удалит ВСЕ заявки.\nПодтвердите действие:", reply_markup=reply_markup)
+        await edit_message(query, "⚠️ Текущий турнир будет закрыт, его заявки уйдут в архив, а регистрация начнётся заново.\nПодтвердите действие:", reply_markup=CONFIRM_RESET_KEYBOARD)
 
     elif data == "back_to_admin_menu":
-        reply_markup = get_admin_menu_keyboard()
-        await query.edit_message_text("👑 Админ-панель", reply_markup=reply_markup)
+        await edit_message(query, ADMIN_MENU_TEXT, reply_markup=ADMIN_MENU_KEYBOARD)
 
 # === УДАЛЕНИЕ ПРОФИЛЯ ===
+@timed_handler("waiting_delete_id")
 async def waiting_delete_id(update: Update, context: ContextTypes.DEFAULT_TYPE):
     # Проверяем флаг, установленный в button_handler
     if not context.user_data.get('awaiting_delete_id'):
         return
 
     try:
-        profile_num = int(update.message.text.strip())
+        profile_nums = parse_profile_numbers(update.message.text.strip())
     except ValueError:
         # Добавляем кнопку "Назад" при ошибке ввода
-        keyboard = [[InlineKeyboardButton("⬅️ Назад", callback_data="back_to_admin_menu")]]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        await update.message.reply_text("❌ Введите число.", reply_markup=reply_markup)
+        await update.message.reply_text(
+            f"❌ Введите номера через запятую, например: 3,7,10-15 (не больше {MAX_BULK_DELETE}).",
+            reply_markup=BACK_KEYBOARD
+        )
         # Не сбрасываем флаг, чтобы пользователь мог попробовать снова
         return
 
-    try:
-        # Для удаления нужно получить полный список, чтобы найти запись по номеру
-        apps = get_all_applications()
-        # Проверка диапазона: profile_num от 1 до len(apps)
-        if profile_num < 1 or profile_num > len(apps):
-            # Добавляем кнопку "Назад" при ошибке ввода номера
-            keyboard = [[InlineKeyboardButton("⬅️ Назад", callback_data="back_to_admin_menu")]]
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            await update.message.reply_text(f"❌ Нет профиля с номером {profile_num}. Введите число от 1 до {len(apps)}.", reply_markup=reply_markup)
-            # Не сбрасываем флаг, чтобы пользователь мог попробовать снова
-            return
-
-        app = apps[profile_num - 1] # Получаем запись по порядковому номеру
-        app_id_to_delete = app['id'] # ID записи в БД
-        context.user_data['delete_app_id'] = app_id_to_delete
-        context.user_data['delete_nickname'] = app['nickname']
+    # Номера берём из снимка списка, который админ видел, а не из текущей таблицы
+    snapshot = get_list_snapshot(context)
+    if not snapshot:
+        await update.message.reply_text("❌ Список устарел. Откройте список участников и введите номер снова.", reply_markup=OPEN_LIST_KEYBOARD)
+        return
 
-        keyboard = [
-            [InlineKeyboardButton("✅ Да, удалить", callback_data="confirm_delete")],
-            [InlineKeyboardButton("❌ Нет, отмена", callback_data="cancel_action")],
-            [InlineKeyboardButton("⬅️ Назад", callback_data="back_to_admin_menu")]
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
+    missing = [num for num in profile_nums if num not in snapshot]
+    if missing:
+        missing_str = ", ".join(str(num) for num in missing[:20])
         await update.message.reply_text(
-            f"❓ Действительно удалить профиль #{profile_num}?\n"
-            f"ID: #{app_id_to_delete}\n"
-            f"Ник: {app['nickname']}\n"
-            f"Ранг: {app['rank']}",
-            reply_markup=reply_markup
+            f"❌ Нет профилей с номерами: {missing_str}. Используйте номера из открытых страниц списка.",
+            reply_markup=BACK_KEYBOARD
         )
+        # Не сбрасываем флаг, чтобы пользователь мог попробовать снова
+        return
+
+    try:
+        num_by_id = {snapshot[num]: num for num in profile_nums}
+        apps = await run_db(get_applications_by_ids, list(num_by_id))
+        if not apps:
+            await update.message.reply_text("❌ Профили уже удалены.", reply_markup=BACK_KEYBOARD)
+            context.user_data['awaiting_delete_id'] = False
+            return ConversationHandler.END
+
+        context.user_data['delete_app_ids'] = [app['id'] for app in apps]
+        context.user_data['delete_nickname'] = apps[0]['nickname']
+
+        if len(apps) == 1:
+            app = apps[0]
+            message = (
+                f"❓ Действительно удалить профиль #{num_by_id[app['id']]}?\n"
+                f"ID: #{app['id']}\n"
+                f"Ник: {app['nickname']}\n"
+                f"Ранг: {app['rank']}"
+            )
+        else:
+            message = f"❓ Действительно удалить профили ({len(apps)})?\n"
+            for app in apps:
+                message += f"{num_by_id[app['id']]}. #{app['id']} {app['nickname']} ({app['rank']})\n"
+            message = truncate(message)
+
+        await update.message.reply_text(message, reply_markup=CONFIRM_DELETE_KEYBOARD)
         # Сбрасываем флаг, так как теперь ждем подтверждения через кнопки
         context.user_data['awaiting_delete_id'] = False
         return CONFIRM_DELETE
     except Exception as e:
         logger.error(f"Ошибка при получении профиля: {e}")
         # Добавляем кнопку "Назад" при ошибке
-        keyboard = [[InlineKeyboardButton("⬅️ Назад", callback_data="back_to_admin_menu")]]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        await update.message.reply_text("❌ Ошибка при поиске профиля.", reply_markup=reply_markup)
+        await update.message.reply_text("❌ Ошибка при поиске профиля.", reply_markup=BACK_KEYBOARD)
         # Сбрасываем флаг в случае ошибки
         context.user_data['awaiting_delete_id'] = False
         return ConversationHandler.END # Завершаем в случае ошибки
 
 # Обработчик подтверждения/отмены удаления
+@timed_handler("confirm_delete_handler")
 async def confirm_delete_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
@@ -324,31 +618,38 @@ async def confirm_delete_handler(update: Update, context: ContextTypes.DEFAULT_T
         return
 
     if query.data == "confirm_delete":
-        app_id = context.user_data.get('delete_app_id')
+        app_ids = context.user_data.get('delete_app_ids') or []
         nickname_val = context.user_data.get('delete_nickname')
         try:
-            # Используем функцию из database.py
-            deleted = delete_application_by_id(app_id)
-            if deleted > 0:
-                await query.edit_message_text(f"✅ Профиль '{nickname_val}' (ID: #{app_id}) удалён.")
+            # Все выбранные профили удаляются одним запросом
+            deleted = await run_db(delete_applications_by_ids, app_ids) if app_ids else 0
+            search_index.remove_ids(app_ids)
+            # Иначе участник ещё DEDUP_WINDOW слышал бы, что удалённая заявка принята
+            recent_submissions.forget_ids(app_ids)
+            # Нумерация после удаления сдвинулась - старый снимок больше не годится
+            clear_list_snapshot(context)
+            if deleted == 1 and len(app_ids) == 1:
+                await edit_message(query, f"✅ Профиль '{nickname_val}' (ID: #{app_ids[0]}) удалён.")
+            elif deleted > 0:
+                await edit_message(query, f"✅ Удалено профилей: {deleted}")
             else:
-                await query.edit_message_text("❌ Профиль не найден.")
+                await edit_message(query, "❌ Профиль не найден.")
         except Exception as e:
             logger.error(f"Ошибка удаления профиля: {e}")
-            await query.edit_message_text("❌ Ошибка при удалении.")
+            await edit_message(query, "❌ Ошибка при удалении.")
     elif query.data in ["cancel_action", "back_to_admin_menu"]: # Обрабатываем обе кнопки
         if query.data == "cancel_action":
-             await query.edit_message_text("❌ Удаление отменено.")
+             await edit_message(query, "❌ Удаление отменено.")
         # В любом случае, если нажата "Назад" или "Отмена", возвращаемся в меню
-        reply_markup = get_admin_menu_keyboard()
-        await query.edit_message_text("👑 Админ-панель", reply_markup=reply_markup)
+        await edit_message(query, ADMIN_MENU_TEXT, reply_markup=ADMIN_MENU_KEYBOARD)
 
     # Сброс состояния
-    context.user_data.pop('delete_app_id', None)
+    context.user_data.pop('delete_app_ids', None)
     context.user_data.pop('delete_nickname', None)
     return ConversationHandler.END
 
-# === СБРОС ВСЕХ ЗАЯВОК ===
+# === ЗАКРЫТИЕ ТУРНИРА ===
+@timed_handler("confirm_reset_handler")
 async def confirm_reset_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
@@ -360,33 +661,305 @@ async def confirm_reset_handler(update: Update, context: ContextTypes.DEFAULT_TY
 
     if query.data == "confirm_reset":
         try:
-            deleted_count = reset_applications()
-            await query.edit_message_text(f"✅ Все заявки удалены. Удалено: {deleted_count}")
+            archived_count = await run_db(close_tournament)
+            clear_list_snapshot(context)
+            # Старые заявки не должны мешать регистрации в новом турнире
+            recent_submissions.clear()
+            search_index.clear()
+            await edit_message(query, f"✅ Турнир закрыт, начат новый. В архиве заявок: {archived_count}")
         except Exception as e:
-            logger.error(f"Ошибка сброса: {e}")
-            await query.edit_message_text("❌ Ошибка при сбросе.")
+            logger.error(f"Ошибка закрытия турнира: {e}")
+            await edit_message(query, "❌ Ошибка при закрытии турнира.")
     elif query.data in ["cancel_action", "back_to_admin_menu"]: # Обрабатываем обе кнопки
         if query.data == "cancel_action":
-             await query.edit_message_text("❌ Сброс отменён.")
+             await edit_message(query, "❌ Закрытие турнира отменено.")
         # В любом случае, если нажата "Назад" или "Отмена", возвращаемся в меню
-        reply_markup = get_admin_menu_keyboard()
-        await query.edit_message_text("👑 Админ-панель", reply_markup=reply_markup)
+        await edit_message(query, ADMIN_MENU_TEXT, reply_markup=ADMIN_MENU_KEYBOARD)
 
-# Основная функция
-def main():
-    initialize_database()
+# === ВЫГРУЗКА ЗАЯВОК ===
+@timed_handler("export_command")
+async def export_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if update.effective_user.id not in ADMIN_IDS:
+        return
+    if not DATABASE_AVAILABLE:
+        await update.message.reply_text("❌ База данных недоступна.")
+        return
+
+    fmt = context.args[0].lower() if context.args else "csv"
+    if fmt not in ("csv", "xlsx"):
+        await update.message.reply_text("Использование: /export [csv|xlsx]")
+        return
+
+    await update.message.reply_text("⏳ Готовлю выгрузку...")
+    path = None
+    try:
+        path, filename = await run_db(export_applications, fmt, timeout=EXPORT_TIMEOUT)
+        with open(path, "rb") as document:
+            await update.message.reply_document(document=document, filename=filename, write_timeout=EXPORT_TIMEOUT)
+    except Exception as e:
+        logger.error(f"Ошибка выгрузки: {e}")
+        await update.message.reply_text(f"❌ Ошибка выгрузки: {e}")
+    finally:
+        if path and os.path.exists(path):
+            os.remove(path)
+
+# === ПОИСК ===
+def format_application(app):
+    name_str = app['name'] if app['name'] else "Не указано"
+    team_str = app['team'] if app['team'] else "Нет"
+    header = f"ID: #{app['id']}\n" if app.get('id') else ""
+    return (
+        f"{header}Ник: {app['nickname']}\nРанг: {app['rank']}\nИмя: {name_str}\n"
+        f"Связь: {app['contact']}\nКоманда: {team_str}"
+    )
+
+async def find_application(app_id):
+    """Анкета по ID из БД, а если она не отвечает - из индекса в памяти"""
+    if DATABASE_AVAILABLE:
+        try:
+            apps = await run_db(get_applications_by_ids, [app_id])
+            return apps[0] if apps else None
+        except Exception as e:
+            logger.error(f"Ошибка получения анкеты: {e}")
+    return search_index.get(app_id)
+
+@timed_handler("find_command")
+async def find_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if update.effective_user.id not in ADMIN_IDS:
+        return
+    query_text = " ".join(context.args).strip()
+    if not query_text:
+        await update.message.reply_text("Использование: /find <ник, имя, контакт или команда>")
+        return
+
+    apps = None
+    if DATABASE_AVAILABLE:
+        try:
+            apps = await run_db(search_applications, query_text, SEARCH_LIMIT)
+        except Exception as e:
+            logger.error(f"Ошибка поиска: {e}")
+    message = ""
+    if apps is None:
+        apps = search_index.search(query_text, SEARCH_LIMIT)
+        message = "⚠️ База данных недоступна, поиск по последним заявкам в памяти.\n"
+
+    if not apps:
+        message += f"🔎 По запросу «{query_text}» ничего не найдено."
+    else:
+        message += f"🔎 Найдено по запросу «{query_text}»:\n"
+        for app in apps:
+            id_str = f"#{app['id']} " if app.get('id') else ""
+            message += f"• {id_str}{app['nickname']} ({app['rank']}) - {app['contact']}\n"
+    message = truncate(message)
+
+    # Без ID (анкета не попала в БД) смотреть и удалять нечего
+    keyboard = []
+    for app in apps:
+        if app.get('id'):
+            keyboard.append([
+                InlineKeyboardButton(f"👁 #{app['id']} {app['nickname']}"[:64], callback_data=f"find_view:{app['id']}"),
+                InlineKeyboardButton("🗑", callback_data=f"find_delete:{app['id']}"),
+            ])
+    keyboard.append([BACK_BUTTON])
+    await update.message.reply_text(message, reply_markup=InlineKeyboardMarkup(keyboard))
+
+@timed_handler("find_button_handler")
+async def find_button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
+    if query.from_user.id not in ADMIN_IDS:
+        return
+
+    action, app_id = query.data.split(":")
+    app = await find_application(int(app_id))
+    if app is None:
+        await edit_message(query, "❌ Профиль не найден.", reply_markup=BACK_KEYBOARD)
+        return
+
+    if action == "find_view":
+        keyboard = [
+            [InlineKeyboardButton("🗑 Удалить", callback_data=f"find_delete:{app['id']}")],
+            [BACK_BUTTON]
+        ]
+        await edit_message(query, f"👤 Профиль\n{format_application(app)}", reply_markup=InlineKeyboardMarkup(keyboard))
+        return
+
+    # Удаление идёт через то же подтверждение, что и удаление по номеру из списка
+    context.user_data['delete_app_ids'] = [app['id']]
+    context.user_data['delete_nickname'] = app['nickname']
+    await edit_message(
+        query,
+        f"❓ Действительно удалить профиль?\n{format_application(app)}",
+        reply_markup=CONFIRM_DELETE_KEYBOARD
+    )
+
+# === РАССЫЛКА ===
+@timed_handler("broadcast_command")
+async def broadcast_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if update.effective_user.id not in ADMIN_IDS:
+        return
+    if not context.bot_data.get('broadcaster'):
+        await update.message.reply_text("❌ База данных недоступна.")
+        return
+    # Текст берём целиком, с переносами строк
+    parts = update.message.text.split(maxsplit=1)
+    if len(parts) < 2:
+        await update.message.reply_text("Использование: /broadcast <текст сообщения участникам>")
+        return
+    text = parts[1][:MAX_MESSAGE_LENGTH]
+    try:
+        recipients = await run_db(count_broadcast_recipients)
+    except Exception as e:
+        logger.error(f"Ошибка подсчёта получателей: {e}")
+        await update.message.reply_text("❌ Ошибка.")
+        return
+    context.user_data['broadcast_text'] = text
+    await update.message.reply_text(
+        f"📣 Разослать участникам текущего турнира ({recipients})?\n\n{text}"[:MAX_MESSAGE_LENGTH],
+        reply_markup=CONFIRM_BROADCAST_KEYBOARD
+    )
 
-    application = Application.builder().token(BOT_TOKEN).build()
+@timed_handler("broadcast_button_handler")
+async def broadcast_button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
+    if query.from_user.id not in ADMIN_IDS:
+        return
+    text = context.user_data.pop('broadcast_text', None)
+    if query.data == "broadcast_cancel":
+        await edit_message(query, "❌ Рассылка отменена.")
+        return
+    if text is None:
+        await edit_message(query, "❌ Рассылка устарела. Отправьте /broadcast снова.")
+        return
+    # Это же сообщение дальше показывает прогресс рассылки
+    await edit_message(query, "📣 Рассылка запускается...")
+    try:
+        job = await context.bot_data['broadcaster'].create(text, query.message.chat_id, query.message.message_id)
+    except Exception as e:
+        logger.error(f"Ошибка запуска рассылки: {e}")
+        await edit_message(query, "❌ Ошибка запуска рассылки.")
+        return
+    logger.info(f"📣 Рассылка #{job['id']} запущена админом {query.from_user.id}")
+
+# === СОСТАВЫ И СЕТКИ ===
+def split_pages(lines, limit=REPORT_PAGE_LENGTH):
+    """Склейка строк отчёта в страницы не длиннее limit символов"""
+    pages = []
+    current = ""
+    for line in lines:
+        line = line[:limit - 1]
+        if current and len(current) + len(line) + 1 > limit:
+            pages.append(current)
+            current = ""
+        current += line + "\n"
+    if current:
+        pages.append(current)
+    return pages
+
+def build_report_page(pages, page):
+    message = pages[page]
+    nav = []
+    if page > 0:
+        nav.append(InlineKeyboardButton("◀️", callback_data=f"report_page:{page - 1}"))
+    if len(pages) > 1:
+        message += f"\nСтраница {page + 1}/{len(pages)}"
+    if page < len(pages) - 1:
+        nav.append(InlineKeyboardButton("▶️", callback_data=f"report_page:{page + 1}"))
+    if not nav:
+        return message, BACK_KEYBOARD
+    return message, InlineKeyboardMarkup([nav, [BACK_BUTTON]])
+
+async def send_report(update, context, build, *args):
+    """Отчёт по анкетам текущего турнира; страницы хранятся у админа до следующего отчёта"""
+    if not DATABASE_AVAILABLE:
+        await update.message.reply_text("❌ База данных недоступна.")
+        return
+    try:
+        apps = await run_db(get_all_applications)
+        # Расчёт составов не должен блокировать цикл событий
+        lines = await asyncio.to_thread(build, apps, *args)
+    except Exception as e:
+        logger.error(f"Ошибка построения отчёта: {e}")
+        await update.message.reply_text("❌ Ошибка.")
+        return
+    pages = split_pages(lines)
+    context.user_data['report_pages'] = pages
+    message, reply_markup = build_report_page(pages, 0)
+    await update.message.reply_text(message, reply_markup=reply_markup)
+
+@timed_handler("teams_command")
+async def teams_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if update.effective_user.id not in ADMIN_IDS:
+        return
+    await send_report(update, context, teams_report)
+
+@timed_handler("bracket_command")
+async def bracket_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if update.effective_user.id not in ADMIN_IDS:
+        return
+    fmt = context.args[0].lower() if context.args else "single"
+    if fmt not in BRACKET_FORMATS:
+        await update.message.reply_text("Использование: /bracket [" + "|".join(BRACKET_FORMATS) + "]")
+        return
+    await send_report(update, context, bracket_report, fmt)
+
+@timed_handler("report_page_handler")
+async def report_page_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
+    if query.from_user.id not in ADMIN_IDS:
+        return
+    pages = context.user_data.get('report_pages')
+    page = int(query.data.split(":")[1])
+    if not pages or page >= len(pages):
+        await edit_message(query, "❌ Отчёт устарел. Запросите /teams или /bracket снова.", reply_markup=BACK_KEYBOARD)
+        return
+    message, reply_markup = build_report_page(pages, page)
+    await edit_message(query, message, reply_markup=reply_markup)
+
+# Сборка приложения со всеми обработчиками.
+# request можно подменить - так делает нагрузочный тест loadtest.py
+def build_application(request=None):
+    # Запросы к Bot API замеряются для /metrics
+    if request is None:
+        request = InstrumentedRequest(connection_pool_size=256)
+        builder = Application.builder().token(BOT_TOKEN).request(request)
+    else:
+        # Подменённый request отвечает и на getUpdates
+        builder = Application.builder().token(BOT_TOKEN).request(request).get_updates_request(request)
+    builder = builder.concurrent_updates(PerUserUpdateProcessor(CONCURRENT_UPDATES))
+    # Незавершённые регистрации переживают перезапуск
+    persistence = create_persistence(DATABASE_AVAILABLE, database_ready)
+    if persistence:
+        builder = builder.persistence(persistence)
+    application = (
+        builder
+        .post_init(post_init)
+        .post_stop(post_stop)
+        .post_shutdown(shutdown)
+        .build()
+    )
 
     # === Обработчики колбэков (кнопок) ДОБАВЛЯЕМ ПЕРВЫМИ ===
     # Это важно для правильной работы кнопок вне диалога
 
     # Обработчики админских кнопок
-    application.add_handler(CallbackQueryHandler(button_handler, pattern="^(stats|list_all|delete_profile|reset_all|back_to_admin_menu)$"))
+    application.add_handler(CallbackQueryHandler(button_handler, pattern="^(stats|list_all|list_next:.+|list_prev:.+|delete_profile|reset_all|back_to_admin_menu)$"))
     # Обработчики подтверждения/отмены удаления и сброса
     application.add_handler(CallbackQueryHandler(confirm_delete_handler, pattern="^(confirm_delete|cancel_action|back_to_admin_menu)$"))
     application.add_handler(CallbackQueryHandler(confirm_reset_handler, pattern="^(confirm_reset|cancel_action|back_to_admin_menu)$"))
 
+    # Выгрузка заявок, поиск, составы, сетки и рассылка для админов
+    application.add_handler(CommandHandler('export', export_command))
+    application.add_handler(CommandHandler('find', find_command))
+    application.add_handler(CommandHandler('teams', teams_command))
+    application.add_handler(CommandHandler('broadcast', broadcast_command))
+    application.add_handler(CallbackQueryHandler(broadcast_button_handler, pattern="^broadcast_(confirm|cancel)$"))
+    application.add_handler(CommandHandler('bracket', bracket_command))
+    application.add_handler(CallbackQueryHandler(report_page_handler, pattern="^report_page:\\d+$"))
+    application.add_handler(CallbackQueryHandler(find_button_handler, pattern="^(find_view|find_delete):\\d+$"))
+
     # === Диалог регистрации ===
     conv_handler = ConversationHandler(
         entry_points=[CommandHandler('start', start)],
@@ -396,17 +969,68 @@ def main():
             NAME: [MessageHandler(filters.TEXT & ~filters.COMMAND, name)],
             CONTACT: [MessageHandler(filters.TEXT & ~filters.COMMAND, contact)],
             TEAM: [MessageHandler(filters.TEXT & ~filters.COMMAND, team)],
+            ConversationHandler.TIMEOUT: [TypeHandler(Update, registration_timeout)],
             # WAITING_DELETE_ID и CONFIRM_DELETE теперь обрабатываются отдельно
         },
         fallbacks=[CommandHandler('cancel', cancel)],
+        name="registration",
+        persistent=persistence is not None,
+        conversation_timeout=REGISTRATION_TIMEOUT,
     )
     application.add_handler(conv_handler)
+    # Считаем прямо по состоянию диалогов: туда попадают и восстановленные после перезапуска
+    REGISTRY.gauge('bot_active_registrations', 'Незавершённые регистрации', lambda: len(conv_handler._conversations))
 
     # Обработчик текстовых сообщений для удаления профиля
     application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, waiting_delete_id), group=1)
+    return application
 
-    logger.info("🚀 Бот запущен")
-    application.run_polling()
+# Основная функция
+def main():
+    initialize_database()
+    application = build_application()
+
+    # Апдейты обрабатывает одна реплика: состояние диалогов, черновики анкет,
+    # снимки списков и кэши живут в памяти процесса, и апдейт, попавший в
+    # другую реплику, потерял бы регистрацию. Остальные ждут в резерве.
+    # Поэтому и в режиме вебхука несколько реплик нагрузку не делят
+    lock = None
+    if DATABASE_AVAILABLE and os.environ.get('DATABASE_URL'):
+        lock = AdvisoryLeaderLock()
+        if wait_for_leadership(lock):
+            application.bot_data['leader_lock'] = lock
+        else:
+            # Без базы бот всё равно принимает анкеты в локальный буфер, поэтому
+            # запускаемся, а от второго процесса на этой машине защищает файл
+            logger.warning("⚠️ БД недоступна: запускаемся с блокировкой через файл, "
+                           "другие реплики на других машинах не видны")
+            lock = None
+    if lock is None:
+        lock = PidFileLock(LOCK_FILE)
+        if not lock.try_acquire():
+            print("❌ Бот уже запущен или предыдущий процесс не завершился.")
+            sys.exit(1)
+    try:
+        if WEBHOOK_URL:
+            # Резервная реплика не слушает порт, поэтому балансировщик шлёт запросы только лидеру.
+            # При остановке PTB дожидается обработчиков, которые уже выполняются
+            logger.info(f"🚀 Бот запущен (вебхук, порт {WEBHOOK_PORT})")
+            application.run_webhook(
+                listen=WEBHOOK_LISTEN,
+                port=WEBHOOK_PORT,
+                url_path=WEBHOOK_PATH,
+                webhook_url=f"{WEBHOOK_URL}/{WEBHOOK_PATH}",
+                secret_token=WEBHOOK_SECRET,
+                max_connections=min(100, CONCURRENT_UPDATES),
+            )
+        else:
+            logger.info("🚀 Бот запущен")
+            application.run_polling()
+    finally:
+        lock.release()
+    if application.bot_data.get('leadership_lost'):
+        # Перезапуск вернёт процесс в резерв
+        sys.exit(1)
 
 if __name__ == '__main__':
     main()
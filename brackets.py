@@ -0,0 +1,422 @@
+# brackets.py
+"""Составы команд и сетки турнира по анкетам.
+
+Всё считается в памяти за O(n log n): сортировка игроков по рейтингу и
+жадное распределение через кучу, без перебора вариантов.
+
+    python brackets.py --players 10000
+"""
+import os
+import re
+import sys
+import time
+import heapq
+import bisect
+import random
+import argparse
+
+# Игроков в команде
+TEAM_SIZE = int(os.environ.get('TEAM_SIZE', '5'))
+# Столько заявок с одинаковой командой нужно, чтобы она считалась командой, а не текстом о себе
+MIN_TEAM_MEMBERS = int(os.environ.get('MIN_TEAM_MEMBERS', '2'))
+# Рейтинг игрока, ранг которого не удалось разобрать
+DEFAULT_RATING = int(os.environ.get('DEFAULT_RATING', '10000'))
+
+NO_TEAM = {'', 'нет', 'нету', 'no', 'none', 'нет команды', 'соло', 'solo', '-'}
+
+# Звания CS в примерный рейтинг Premier; более длинные названия проверяются первыми
+RANK_NAMES = [
+    (r'global|глобал|\bge(?![a-zа-я])', 20000),
+    (r'supreme|суприм|\bsmfc(?![a-zа-я])', 17000),
+    (r'legendary eagle master|\blem(?![a-zа-я])|лем', 15000),
+    (r'legendary eagle|\ble(?![a-zа-я])|беркут', 13500),
+    (r'distinguished master guardian|\bdmg(?![a-zа-я])|дмг', 12000),
+    (r'master guardian elite|\bmge(?![a-zа-я])|мге', 11000),
+    (r'master guardian|\bmg(?![a-zа-я])|калаш', 9500),
+    (r'gold nova|\bgn(?![a-zа-я])|нова|золот', 7000),
+    (r'silver|сильвер|серебр', 3000),
+]
+_RANK_PATTERNS = [(re.compile(pattern), rating) for pattern, rating in RANK_NAMES]
+_NUMBER = re.compile(r'(\d+(?:[.,]\d+)?)\s*(k|к|тыс)?')
+_LEVEL = re.compile(r'lvl|level|лвл|уровень|faceit|фейсит')
+_TEAM_JUNK = re.compile(r'[\s"\'«»`.,!]+')
+
+
+def parse_rank(text):
+    """Рейтинг Premier из свободного текста: "15000", "15к", "15 300", "10 lvl faceit", "Gold Nova".
+
+    Возвращает None, если разобрать не удалось.
+    """
+    text = (text or '').casefold()
+    # "15 300" -> "15300", но "10 lvl" не трогаем
+    compact = re.sub(r'(?<=\d)[\s ](?=\d{3}\b)', '', text)
+    match = _NUMBER.search(compact)
+    value = None
+    if match:
+        value = float(match.group(1).replace(',', '.'))
+        if match.group(2):
+            value *= 1000
+        if _LEVEL.search(compact) and value <= 10:
+            # Уровень FACEIT 1-10
+            return int(value * 2000)
+        if value >= 100:
+            return int(value)
+    # Звание проверяется раньше короткого числа: в "Gold Nova 3" число - это ступень звания
+    for pattern, rating in _RANK_PATTERNS:
+        if pattern.search(text):
+            return rating
+    if value is not None and value <= 40:
+        # Короткое число вроде "25" или "15.5" - это тысячи Premier
+        return int(value * 1000)
+    return None
+
+
+def normalize_team(team):
+    """Ключ команды без регистра, кавычек и пробелов; None - игрок без команды"""
+    key = _TEAM_JUNK.sub(' ', (team or '').casefold()).strip()
+    if key in NO_TEAM:
+        return None
+    return key
+
+
+class Player:
+    def __init__(self, app):
+        self.app = app
+        self.nickname = app['nickname']
+        parsed = parse_rank(app['rank'])
+        self.rating = parsed if parsed is not None else DEFAULT_RATING
+        self.rated = parsed is not None
+
+
+class Team:
+    def __init__(self, name, players=(), premade=False):
+        self.name = name
+        self.players = list(players)
+        self.premade = premade
+
+    @property
+    def rating(self):
+        if not self.players:
+            return 0
+        return sum(p.rating for p in self.players) // len(self.players)
+
+
+def build_rosters(apps, team_size=TEAM_SIZE, min_members=MIN_TEAM_MEMBERS):
+    """Разбивка анкет на готовые команды и одиночек.
+
+    Возвращает (команды, одиночки). Команды с одним участником считаются
+    одиночками: в поле команды часто пишут просто пару слов о себе.
+    Команда больше team_size делится на составы "Название", "Название 2"...
+    """
+    groups = {}
+    names = {}
+    solos = []
+    for app in apps:
+        player = Player(app)
+        key = normalize_team(app['team'])
+        if key is None:
+            solos.append(player)
+            continue
+        groups.setdefault(key, []).append(player)
+        # Название показываем в том виде, в каком его написали чаще всего
+        counts = names.setdefault(key, {})
+        written = app['team'].strip()
+        counts[written] = counts.get(written, 0) + 1
+
+    teams = []
+    for key, players in groups.items():
+        if len(players) < min_members:
+            solos.extend(players)
+            continue
+        name = max(names[key].items(), key=lambda item: item[1])[0]
+        # Команду больше team_size делим на составы: сильнейшие игроки - в первом
+        players.sort(key=lambda p: p.rating, reverse=True)
+        for i in range(0, len(players), team_size):
+            squad = name if i == 0 else f"{name} {i // team_size + 1}"
+            teams.append(Team(squad, players[i:i + team_size], premade=True))
+    return teams, solos
+
+
+def fill_rosters(teams, solos, team_size=TEAM_SIZE):
+    """Добор неполных готовых команд одиночками с близким рейтингом.
+
+    Первыми добираются команды, которым не хватает меньше всего игроков:
+    так при нехватке одиночек полных составов получается больше. Игрок
+    берётся ближайший по рейтингу к среднему команды (бинарный поиск по
+    отсортированным одиночкам). Возвращает оставшихся одиночек; если их
+    не хватило, команда остаётся неполной.
+    """
+    pool = sorted(solos, key=lambda p: p.rating)
+    ratings = [p.rating for p in pool]
+    short = sorted((t for t in teams if len(t.players) < team_size),
+                   key=lambda t: team_size - len(t.players))
+    for team in short:
+        while len(team.players) < team_size and pool:
+            i = bisect.bisect_left(ratings, team.rating)
+            if i == len(pool) or (i > 0 and team.rating - ratings[i - 1] <= ratings[i] - team.rating):
+                i -= 1
+            ratings.pop(i)
+            team.players.append(pool.pop(i))
+    return pool
+
+
+def balance_solos(players, team_size=TEAM_SIZE, first_number=1):
+    """Распределение одиночек по командам с близкой суммой рейтинга.
+
+    Жадный LPT: игроки по убыванию рейтинга, каждый уходит в неполную
+    команду с наименьшей суммой (куча по сумме), O(n log k).
+    Возвращает (команды, запасные), запасных меньше team_size.
+    """
+    players = sorted(players, key=lambda p: p.rating, reverse=True)
+    team_count = len(players) // team_size
+    if team_count == 0:
+        return [], players
+    # Самые слабые игроки сверх полных составов остаются в запасе
+    assigned, reserve = players[:team_count * team_size], players[team_count * team_size:]
+    teams = [Team(f"Сборная {first_number + i}") for i in range(team_count)]
+    heap = [(0, i) for i in range(team_count)]
+    for player in assigned:
+        total, i = heapq.heappop(heap)
+        teams[i].players.append(player)
+        if len(teams[i].players) < team_size:
+            heapq.heappush(heap, (total + player.rating, i))
+    return teams, reserve
+
+
+def make_teams(apps, team_size=TEAM_SIZE):
+    """Готовые команды и сборные из одиночек. Возвращает (команды по убыванию рейтинга, запасные)"""
+    premade, solos = build_rosters(apps, team_size)
+    solos = fill_rosters(premade, solos, team_size)
+    mixed, reserve = balance_solos(solos, team_size)
+    teams = sorted(premade + mixed, key=lambda t: t.rating, reverse=True)
+    return teams, reserve
+
+
+# === Сетки ===
+class Match:
+    """Матч сетки. Участник - название команды, ссылка на другой матч ("W3", "L3") или None (свободный проход)"""
+
+    def __init__(self, number, round_name, first, second):
+        self.number = number
+        self.round_name = round_name
+        self.first = first
+        self.second = second
+
+
+def seed_order(size):
+    """Порядок посевов в сетке на size мест: 1 и 2 встречаются только в финале"""
+    order = [1]
+    while len(order) < size:
+        total = len(order) * 2 + 1
+        order = [seed for s in order for seed in (s, total - s)]
+    return order
+
+
+def _bracket_size(count):
+    size = 1
+    while size < count:
+        size *= 2
+    return size
+
+
+def _round_name(matches_in_round):
+    if matches_in_round == 1:
+        return "Финал"
+    if matches_in_round == 2:
+        return "Полуфинал"
+    return f"1/{matches_in_round}"
+
+
+def single_elimination(teams):
+    """Олимпийская сетка; teams уже отсортированы по силе (первая - посев 1)"""
+    matches, _ = _winners_bracket(teams)
+    return matches
+
+
+def _winners_bracket(teams):
+    size = _bracket_size(max(len(teams), 2))
+    slots = [teams[seed - 1].name if seed <= len(teams) else None for seed in seed_order(size)]
+    matches = []
+    rounds = []
+    current = slots
+    while len(current) > 1:
+        round_matches = []
+        name = _round_name(len(current) // 2)
+        for i in range(0, len(current), 2):
+            match = Match(len(matches) + 1, name, current[i], current[i + 1])
+            matches.append(match)
+            round_matches.append(match)
+        rounds.append(round_matches)
+        current = [f"W{m.number}" for m in round_matches]
+    return matches, rounds
+
+
+def double_elimination(teams):
+    """Сетка до двух поражений: верхняя сетка, нижняя сетка и гранд-финал"""
+    matches, rounds = _winners_bracket(teams)
+    for match in matches:
+        match.round_name = "Верхняя сетка: " + match.round_name
+
+    def add(round_name, first, second):
+        match = Match(len(matches) + 1, round_name, first, second)
+        matches.append(match)
+        return match
+
+    lower_round = 1
+
+    def lower(pairs):
+        """Раунд нижней сетки. None - нет участника (в верхней сетке был
+        свободный проход), его соперник проходит дальше без матча."""
+        nonlocal lower_round
+        name = f"Нижняя сетка: раунд {lower_round}"
+        played = len(matches)
+        winners = []
+        for first, second in pairs:
+            if first is None or second is None:
+                winners.append(first if second is None else second)
+            else:
+                winners.append(f"W{add(name, first, second).number}")
+        if len(matches) > played:
+            lower_round += 1
+        return winners
+
+    def dropped(upper):
+        # У матча со свободным проходом нет проигравшего
+        return [None if m.first is None or m.second is None else f"L{m.number}" for m in upper]
+
+    # Нижняя сетка: проигравшие первого раунда играют между собой, затем
+    # каждый раунд встречают проигравших следующего раунда верхней сетки
+    losers = dropped(rounds[0])
+    if len(losers) > 1:
+        losers = lower(zip(losers[::2], losers[1::2]))
+    for upper in rounds[1:]:
+        # Проигравшие верхней сетки идут в обратном порядке, чтобы не было повторных встреч
+        losers = lower(zip(losers, reversed(dropped(upper))))
+        if len(losers) > 1:
+            losers = lower(zip(losers[::2], losers[1::2]))
+    add("Гранд-финал", f"W{rounds[-1][0].number}", losers[0])
+    return matches
+
+
+def swiss_pairings(teams, points=None, played=None):
+    """Пары очередного тура швейцарской системы.
+
+    points - очки команд по названию, played - множество сыгранных пар
+    frozenset({a, b}). В первом туре верхняя половина играет с нижней
+    (1-й с N/2+1-м), дальше соседи по таблице без повторных встреч.
+    Возвращает список матчей; при нечётном числе команд последняя получает свободный тур.
+    """
+    points = points or {}
+    played = played or set()
+    order = sorted(teams, key=lambda t: (points.get(t.name, 0), t.rating), reverse=True)
+    names = [t.name for t in order]
+    matches = []
+    bye = None
+    if len(names) % 2:
+        # Свободный тур - самой слабой команде без него
+        bye = names.pop()
+    if not played:
+        half = len(names) // 2
+        pairs = zip(names[:half], names[half:])
+    else:
+        pairs = []
+        free = list(names)
+        while free:
+            first = free.pop(0)
+            partner = next((n for n in free if frozenset((first, n)) not in played), free[0])
+            free.remove(partner)
+            pairs.append((first, partner))
+    for first, second in pairs:
+        matches.append(Match(len(matches) + 1, "Тур", first, second))
+    if bye is not None:
+        matches.append(Match(len(matches) + 1, "Тур", bye, None))
+    return matches
+
+
+# === Текст для админов ===
+def _slot(value):
+    if value is None:
+        return "— (проход)"
+    if value[:1] in ("W", "L") and value[1:].isdigit():
+        return ("победитель" if value[0] == "W" else "проигравший") + f" м.{value[1:]}"
+    return value
+
+
+def format_teams(teams, reserve):
+    lines = [f"👥 Команд: {len(teams)}, запасных: {len(reserve)}"]
+    for i, team in enumerate(teams, 1):
+        kind = "" if team.premade else " (сборная)"
+        lines.append(f"{i}. {team.name}{kind} - средний рейтинг {team.rating}")
+        players = ", ".join(f"{p.nickname} ({p.rating if p.rated else '?'})" for p in team.players)
+        lines.append(f"   {players}")
+    if reserve:
+        lines.append("Запасные: " + ", ".join(f"{p.nickname} ({p.rating})" for p in reserve))
+    return lines
+
+
+def format_matches(title, matches):
+    lines = [title]
+    current = None
+    for match in matches:
+        if match.round_name != current:
+            current = match.round_name
+            lines.append(f"— {current} —")
+        if match.second is None and match.first is not None and match.round_name == "Тур":
+            lines.append(f"М{match.number}: {match.first} - свободный тур")
+        else:
+            lines.append(f"М{match.number}: {_slot(match.first)} vs {_slot(match.second)}")
+    return lines
+
+
+BRACKET_FORMATS = {
+    'single': ("🏆 Олимпийская сетка", single_elimination),
+    'double': ("🏆 Сетка до двух поражений", double_elimination),
+    'swiss': ("🏆 Швейцарская система, 1-й тур", swiss_pairings),
+}
+
+def teams_report(apps, team_size=TEAM_SIZE):
+    teams, reserve = make_teams(apps, team_size)
+    return format_teams(teams, reserve)
+
+def bracket_report(apps, fmt, team_size=TEAM_SIZE):
+    title, build = BRACKET_FORMATS[fmt]
+    teams, _ = make_teams(apps, team_size)
+    if len(teams) < 2:
+        return [f"{title}\nНужно хотя бы две команды, сейчас: {len(teams)}."]
+    return format_matches(title, build(teams))
+
+
+# === Бенчмарк ===
+def _random_apps(count):
+    ranks = ["Gold Nova 3", "Global Elite", "10 lvl faceit", "15к", "MG2", "Silver 4", "не знаю"]
+    teams = ["Нет"] * 8 + [f"Team {i}" for i in range(count // 25 or 1)]
+    apps = []
+    for i in range(count):
+        rank = random.choice(ranks) if i % 3 else str(random.randint(1000, 30000))
+        apps.append({'id': i, 'nickname': f"player{i}", 'rank': rank, 'team': random.choice(teams)})
+    return apps
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Замер составов и сеток на случайных анкетах")
+    parser.add_argument("--players", type=int, default=10000, help="сколько анкет")
+    parser.add_argument("--team-size", type=int, default=TEAM_SIZE)
+    args = parser.parse_args()
+
+    apps = _random_apps(args.players)
+    started = time.perf_counter()
+    teams, reserve = make_teams(apps, args.team_size)
+    elapsed = time.perf_counter() - started
+    print(f"Составы: {len(teams)} команд, {len(reserve)} запасных за {elapsed * 1000:.1f} мс")
+    mixed = [t.rating for t in teams if not t.premade]
+    if mixed:
+        print(f"Разброс среднего рейтинга сборных: {min(mixed)}-{max(mixed)}")
+    for fmt, (title, build) in BRACKET_FORMATS.items():
+        started = time.perf_counter()
+        matches = build(teams)
+        lines = format_matches(title, matches)
+        elapsed = time.perf_counter() - started
+        print(f"{fmt}: {len(matches)} матчей, {len(lines)} строк за {elapsed * 1000:.1f} мс")
+
+if __name__ == '__main__':
+    sys.exit(main())
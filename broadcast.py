@@ -0,0 +1,134 @@
+# broadcast.py
+import os
+import time
+import asyncio
+import logging
+
+from telegram.error import BadRequest
+
+from notifications import send_with_retry
+from database import (
+    run_db,
+    create_broadcast,
+    claim_broadcasts,
+    get_broadcast_recipients,
+    save_broadcast_progress,
+)
+
+logger = logging.getLogger(__name__)
+
+# Сколько получателей читать из БД за раз; после каждой порции прогресс сохраняется
+BROADCAST_BATCH_SIZE = int(os.environ.get('BROADCAST_BATCH_SIZE', '100'))
+# На сколько секунд процесс занимает рассылку; после падения её подхватят по истечении срока
+BROADCAST_LEASE = float(os.environ.get('BROADCAST_LEASE', '60'))
+# Не чаще этого (в секундах) обновляется сообщение с прогрессом у админа
+BROADCAST_PROGRESS_INTERVAL = float(os.environ.get('BROADCAST_PROGRESS_INTERVAL', '3'))
+
+
+class Broadcaster:
+    """Рассылка участникам турнира по заданиям из таблицы broadcasts.
+
+    Получатели читаются порциями по возрастанию user_id, после каждой
+    порции в БД сохраняется последний user_id. Упавшая или остановленная
+    рассылка продолжается с этого места - здесь или в другой реплике.
+    """
+
+    def __init__(self, bot, limiter, batch_size=BROADCAST_BATCH_SIZE, lease=BROADCAST_LEASE,
+                 progress_interval=BROADCAST_PROGRESS_INTERVAL):
+        self.bot = bot
+        self.limiter = limiter
+        self.batch_size = batch_size
+        self.lease = lease
+        self.progress_interval = progress_interval
+        self._jobs = {}  # ID рассылки -> задача
+        self._watcher = None
+
+    def start(self):
+        self._watcher = asyncio.create_task(self._watch())
+
+    async def stop(self):
+        tasks = list(self._jobs.values())
+        if self._watcher:
+            tasks.append(self._watcher)
+            self._watcher = None
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def create(self, text, admin_chat_id, progress_message_id):
+        """Новая рассылка по текущему турниру; запускается сразу"""
+        job = await run_db(create_broadcast, text, admin_chat_id, progress_message_id, self.lease)
+        self._launch(job)
+        return job
+
+    def _launch(self, job):
+        if job['id'] in self._jobs:
+            return
+        task = asyncio.create_task(self._run(job))
+        self._jobs[job['id']] = task
+        task.add_done_callback(lambda _: self._jobs.pop(job['id'], None))
+
+    async def _watch(self):
+        # При запуске и затем раз в срок занятости подбираем брошенные рассылки
+        while True:
+            try:
+                for job in await run_db(claim_broadcasts, self.lease):
+                    logger.info(f"📣 Продолжаем рассылку #{job['id']} после user_id {job['last_user_id']}")
+                    self._launch(job)
+            except Exception as e:
+                logger.error(f"Ошибка проверки рассылок: {e}")
+            await asyncio.sleep(self.lease)
+
+    async def _send(self, chat_id, text):
+        try:
+            await send_with_retry(self.bot, self.limiter, chat_id, text)
+            return True
+        except Exception as e:
+            # Заблокировал бота, удалил чат и т.п. - считаем ошибкой и идём дальше
+            logger.debug(f"Рассылка: не доставлено в {chat_id}: {e}")
+            return False
+
+    async def _report(self, job, sent, failed, finished=False):
+        status = "✅ завершена" if finished else "⏳ идёт"
+        text = f"📣 Рассылка #{job['id']} {status}\nОтправлено: {sent}\nНе доставлено: {failed}"
+        try:
+            await self.bot.edit_message_text(
+                text, chat_id=job['admin_chat_id'], message_id=job['progress_message_id']
+            )
+        except BadRequest as e:
+            # "Message is not modified" и удалённое админом сообщение не мешают рассылке
+            logger.debug(f"Не удалось обновить прогресс рассылки: {e}")
+        except Exception as e:
+            logger.warning(f"Не удалось обновить прогресс рассылки: {e}")
+
+    async def _run(self, job):
+        cursor, sent, failed = job['last_user_id'], job['sent'], job['failed']
+        reported_at = time.monotonic()
+        try:
+            while True:
+                recipients = await run_db(get_broadcast_recipients, job['tournament_id'], cursor, self.batch_size)
+                if not recipients:
+                    break
+                # Порция уходит параллельно, темп задаёт общий ограничитель (~30 сообщений/с)
+                results = await asyncio.gather(*(self._send(chat_id, job['text']) for chat_id in recipients))
+                delivered = sum(results)
+                sent += delivered
+                failed += len(results) - delivered
+                cursor = recipients[-1]
+                await run_db(save_broadcast_progress, job['id'], cursor, sent, failed, self.lease)
+                if time.monotonic() - reported_at >= self.progress_interval:
+                    await self._report(job, sent, failed)
+                    reported_at = time.monotonic()
+            await run_db(save_broadcast_progress, job['id'], cursor, sent, failed, self.lease, 'done')
+            await self._report(job, sent, failed, finished=True)
+            logger.info(f"📣 Рассылка #{job['id']} завершена: отправлено {sent}, не доставлено {failed}")
+        except asyncio.CancelledError:
+            # Остановка бота: освобождаем рассылку, чтобы после перезапуска её подхватили сразу
+            try:
+                await run_db(save_broadcast_progress, job['id'], cursor, sent, failed, 0)
+            except Exception:
+                pass
+            raise
+        except Exception as e:
+            # Рассылка остаётся незавершённой и будет подхвачена после истечения срока занятости
+            logger.error(f"Ошибка рассылки #{job['id']}: {e}")
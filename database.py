@@ -1,116 +1,766 @@
 # database.py
-import psycopg2
 import os
-from psycopg2.extras import RealDictCursor
+import time
+import asyncio
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+import psycopg2
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE
+from psycopg2.extras import RealDictCursor, execute_values
+
+from dedup import normalize_key
+from migrations import migrate, SEARCH_DOCUMENT, SEARCH_MIGRATION
+from metrics import REGISTRY, DB_CALL_SECONDS, DB_CALL_ERRORS, DB_CONNECTIONS_OPENED
+
+logger = logging.getLogger(__name__)
 
 # Получаем URL базы данных из переменных окружения
 DATABASE_URL = os.environ.get('DATABASE_URL')
 
+# Настройки пула соединений
+DB_POOL_MIN = int(os.environ.get('DB_POOL_MIN', '1'))
+DB_POOL_MAX = int(os.environ.get('DB_POOL_MAX', '10'))
+# Сколько секунд ждать свободное соединение, прежде чем сдаться
+DB_POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', '5'))
+# Сколько секунд ждать установки соединения: недоступная БД даёт ошибку соединения, а не зависание
+DB_CONNECT_TIMEOUT = int(os.environ.get('DB_CONNECT_TIMEOUT', '5'))
+# Соединение, пролежавшее в пуле дольше этого, проверяется через SELECT 1
+DB_HEALTHCHECK_INTERVAL = float(os.environ.get('DB_HEALTHCHECK_INTERVAL', '30'))
+
+# Ограничения для вызовов из асинхронных обработчиков
+DB_CALL_TIMEOUT = float(os.environ.get('DB_CALL_TIMEOUT', '10'))
+# Сколько вызовов может одновременно выполняться или ждать соединения
+DB_MAX_PENDING = int(os.environ.get('DB_MAX_PENDING', '100'))
+
+# Предохранитель: после стольких ошибок соединения подряд вызовы БД сразу отклоняются
+DB_BREAKER_FAILURES = int(os.environ.get('DB_BREAKER_FAILURES', '5'))
+# Через сколько секунд после срабатывания пробуем БД снова
+DB_BREAKER_RESET = float(os.environ.get('DB_BREAKER_RESET', '30'))
+
+# Как долго статистика из памяти считается верной без сверки с БД
+STATS_CACHE_TTL = float(os.environ.get('STATS_CACHE_TTL', '300'))
+
+
+class PoolTimeoutError(Exception):
+    """Не удалось получить соединение из пула за отведённое время"""
+
+
+class DatabaseBusyError(Exception):
+    """Слишком много ожидающих запросов к базе данных"""
+
+
+class DatabaseUnavailableError(Exception):
+    """База данных недоступна, предохранитель не пропускает вызовы"""
+
+
+# Запись не удалась из-за соединения или перегрузки, а не из-за данных - её можно повторить позже
+TRANSIENT_ERRORS = (
+    psycopg2.OperationalError,
+    psycopg2.InterfaceError,
+    PoolTimeoutError,
+    DatabaseBusyError,
+    DatabaseUnavailableError,
+    asyncio.TimeoutError,
+)
+
+
 # === ВАЖНО: ЭТА ФУНКЦИЯ ДОЛЖНА БЫТЬ ПЕРВОЙ ===
 def get_db_connection():
     """Создание подключения к базе данных"""
-    return psycopg2.connect(DATABASE_URL, cursor_factory=RealDictCursor)
+    # statement_timeout не даёт зависшему запросу надолго занять поток и соединение
+    timeout_ms = int(DB_CALL_TIMEOUT * 1000)
+    return psycopg2.connect(
+        DATABASE_URL,
+        cursor_factory=RealDictCursor,
+        connect_timeout=DB_CONNECT_TIMEOUT,
+        options=f"-c statement_timeout={timeout_ms}",
+    )
+
+
+# === Пул соединений ===
+class ConnectionPool:
+    """Потокобезопасный пул соединений с ограничением размера и таймаутом выдачи"""
+
+    def __init__(self, minconn, maxconn, timeout, healthcheck_interval):
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self.healthcheck_interval = healthcheck_interval
+        self.opened = 0  # сколько соединений открыто за всё время
+        self.in_use = 0
+        self._slots = threading.BoundedSemaphore(maxconn)
+        self._lock = threading.Lock()
+        self._idle = []  # стек пар (соединение, время возврата в пул)
+        self._closed = False
+        for _ in range(minconn):
+            self._idle.append((self._connect(), time.monotonic()))
+
+    def _connect(self):
+        conn = get_db_connection()
+        with self._lock:
+            self.opened += 1
+        DB_CONNECTIONS_OPENED.inc()
+        return conn
+
+    def _is_alive(self, conn, returned_at):
+        if conn.closed:
+            return False
+        if time.monotonic() - returned_at < self.healthcheck_interval:
+            return True
+        # Давно не использовалось - сервер мог закрыть соединение
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            conn.close()
+            return False
+
+    def _checkout(self):
+        while True:
+            with self._lock:
+                if not self._idle:
+                    break
+                conn, returned_at = self._idle.pop()
+            if self._is_alive(conn, returned_at):
+                return conn
+        return self._connect()
+
+    def _release(self, conn):
+        if conn.closed:
+            return
+        # В пул возвращаем только соединения без открытой транзакции
+        if conn.get_transaction_status() != TRANSACTION_STATUS_IDLE:
+            conn.close()
+            return
+        with self._lock:
+            if self._closed:
+                conn.close()
+            else:
+                self._idle.append((conn, time.monotonic()))
+
+    @contextmanager
+    def connection(self):
+        """Соединение из пула: коммит при успехе, откат при ошибке"""
+        if not self._slots.acquire(timeout=self.timeout):
+            raise PoolTimeoutError(f"Нет свободного соединения за {self.timeout} с")
+        conn = None
+        with self._lock:
+            self.in_use += 1
+        try:
+            conn = self._checkout()
+            try:
+                yield conn
+                conn.commit()
+            except BaseException:
+                if not conn.closed:
+                    try:
+                        conn.rollback()
+                    except psycopg2.Error:
+                        conn.close()
+                raise
+        finally:
+            if conn is not None:
+                self._release(conn)
+            with self._lock:
+                self.in_use -= 1
+            self._slots.release()
+
+    @property
+    def idle(self):
+        return len(self._idle)
+
+    def close(self):
+        """Закрытие всех свободных соединений"""
+        with self._lock:
+            self._closed = True
+            idle, self._idle = self._idle, []
+        for conn, _ in idle:
+            conn.close()
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def get_pool():
+    """Ленивое создание общего пула соединений"""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool(DB_POOL_MIN, DB_POOL_MAX, DB_POOL_TIMEOUT, DB_HEALTHCHECK_INTERVAL)
+    return _pool
+
+def close_pool():
+    """Закрытие пула при остановке бота"""
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.close()
+            _pool = None
+
+REGISTRY.gauge('bot_db_connections_in_use', 'Соединения, выданные из пула', lambda: _pool.in_use if _pool else 0)
+REGISTRY.gauge('bot_db_connections_idle', 'Свободные соединения в пуле', lambda: _pool.idle if _pool else 0)
+
+@contextmanager
+def db_cursor():
+    """Курсор на соединении из пула, транзакция фиксируется при выходе"""
+    with get_pool().connection() as conn:
+        with conn.cursor() as cur:
+            yield cur
+
+# === Предохранитель ===
+class CircuitBreaker:
+    """Размыкается после failure_threshold ошибок соединения подряд.
+
+    Пока он разомкнут, вызовы отклоняются сразу, без ожидания таймаутов.
+    Через reset_timeout секунд пропускается один пробный вызов: успех
+    замыкает предохранитель, ошибка размыкает его снова.
+    """
+
+    def __init__(self, failure_threshold, reset_timeout):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._probing = False
+
+    @property
+    def is_open(self):
+        return self.opened_at is not None
+
+    def allow(self):
+        if self.opened_at is None:
+            return True
+        if self._probing or time.monotonic() - self.opened_at < self.reset_timeout:
+            return False
+        self._probing = True
+        return True
+
+    def record_success(self):
+        if self.opened_at is not None:
+            logger.info("✅ База данных снова доступна")
+        self.failures = 0
+        self.opened_at = None
+        self._probing = False
+
+    def record_timeout(self):
+        # Ответа нет: это не ошибка соединения, но и пробный вызов не удался
+        if self._probing:
+            self.record_failure()
+
+    def record_failure(self):
+        self.failures += 1
+        self._probing = False
+        if self.opened_at is None and self.failures < self.failure_threshold:
+            return
+        if self.opened_at is None:
+            logger.error(f"❌ База данных недоступна, вызовы отклоняются {self.reset_timeout:.0f} с")
+        self.opened_at = time.monotonic()
+
+circuit_breaker = CircuitBreaker(DB_BREAKER_FAILURES, DB_BREAKER_RESET)
+REGISTRY.gauge('bot_db_circuit_open', 'Предохранитель БД разомкнут', lambda: int(circuit_breaker.is_open))
+
+def _is_connection_error(e):
+    # Медленные запросы - не падение БД: отмена по statement_timeout, таймаут run_db
+    # (он наступает раньше statement_timeout) и очередь за соединением пула.
+    # Недоступная БД даёт ошибку соединения не позже DB_CONNECT_TIMEOUT
+    if isinstance(e, psycopg2.extensions.QueryCanceledError):
+        return False
+    return isinstance(e, (psycopg2.OperationalError, psycopg2.InterfaceError))
+
+# === Вызовы из асинхронного кода ===
+# Потоков столько же, сколько соединений: лишние всё равно ждали бы пул
+_executor = ThreadPoolExecutor(max_workers=DB_POOL_MAX, thread_name_prefix="db")
+_pending = 0
+
+def _release_pending(_future):
+    global _pending
+    _pending -= 1
+
+async def run_db(func, *args, timeout=None):
+    """Выполнение функции БД в отдельном потоке, не блокируя цикл событий"""
+    global _pending
+    if _pending >= DB_MAX_PENDING:
+        raise DatabaseBusyError(f"В очереди к БД уже {_pending} запросов")
+    if not circuit_breaker.allow():
+        DB_CALL_ERRORS.inc(func.__name__)
+        raise DatabaseUnavailableError("База данных недоступна")
+    loop = asyncio.get_running_loop()
+    future = loop.run_in_executor(_executor, func, *args)
+    _pending += 1
+    # Слот освобождается, только когда поток действительно закончил работу
+    future.add_done_callback(_release_pending)
+    started = time.monotonic()
+    try:
+        result = await asyncio.wait_for(asyncio.shield(future), timeout or DB_CALL_TIMEOUT)
+    except Exception as e:
+        DB_CALL_ERRORS.inc(func.__name__)
+        if _is_connection_error(e):
+            circuit_breaker.record_failure()
+        elif isinstance(e, (asyncio.TimeoutError, PoolTimeoutError)):
+            circuit_breaker.record_timeout()
+        else:
+            # БД ответила, пусть и ошибкой - она доступна
+            circuit_breaker.record_success()
+        raise
+    else:
+        circuit_breaker.record_success()
+        return result
+    finally:
+        DB_CALL_SECONDS.observe(time.monotonic() - started, func.__name__)
+
+REGISTRY.gauge('bot_db_pending_calls', 'Вызовы БД в работе или в ожидании', lambda: _pending)
 
-# === Теперь можно использовать get_db_connection ===
+# === Кэш статистики ===
+class StatsCache:
+    """Статистика в памяти, обновляемая при каждом изменении заявок.
+
+    Раз в ttl секунд (или после invalidate) она заново считается в БД -
+    это подхватывает изменения, сделанные другими процессами.
+    """
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._total = None  # None - кэш пуст
+        self._teams = {}
+        self._sorted = None
+        self._loaded_at = 0.0
+        # Меняется при каждой правке, чтобы не сохранить устаревший результат запроса
+        self.generation = 0
+
+    @staticmethod
+    def _counted(team):
+        # То же условие, что и в запросе get_stats
+        return team is not None and team != 'Нет'
+
+    def get(self):
+        with self._lock:
+            if self._total is None or time.monotonic() - self._loaded_at > self.ttl:
+                return None
+            if self._sorted is None:
+                self._sorted = [
+                    {'team': team, 'count': count}
+                    for team, count in sorted(self._teams.items(), key=lambda item: -item[1])
+                ]
+            return self._total, self._sorted
+
+    def load(self, total, teams, generation):
+        with self._lock:
+            if generation != self.generation:
+                return
+            self._total = total
+            self._teams = {row['team']: row['count'] for row in teams}
+            self._sorted = None
+            self._loaded_at = time.monotonic()
+
+    def add(self, teams):
+        with self._lock:
+            self.generation += 1
+            if self._total is None:
+                return
+            self._total += len(teams)
+            for team in teams:
+                if self._counted(team):
+                    self._teams[team] = self._teams.get(team, 0) + 1
+                    self._sorted = None
+
+    def remove(self, teams):
+        with self._lock:
+            self.generation += 1
+            if self._total is None:
+                return
+            self._total = max(0, self._total - len(teams))
+            for team in teams:
+                if self._counted(team) and team in self._teams:
+                    self._teams[team] -= 1
+                    if self._teams[team] <= 0:
+                        del self._teams[team]
+                    self._sorted = None
+
+    def clear(self):
+        with self._lock:
+            self.generation += 1
+            self._total = 0
+            self._teams = {}
+            self._sorted = None
+            self._loaded_at = time.monotonic()
+
+    def invalidate(self):
+        with self._lock:
+            self.generation += 1
+            self._total = None
+
+
+_stats_cache = StatsCache(STATS_CACHE_TTL)
+
+def invalidate_stats_cache():
+    """Сброс кэша статистики: следующий get_stats пойдёт в БД"""
+    _stats_cache.invalidate()
+
+# Подзапрос текущего турнира; подставляется в запросы вместо параметра,
+# чтобы все реплики бота видели смену турнира без кэша
+ACTIVE_TOURNAMENT = "(SELECT id FROM tournaments WHERE closed_at IS NULL)"
+
+# === Теперь можно использовать db_cursor ===
 
 def init_db():
-    """Инициализация базы данных - создание таблиц"""
-    conn = get_db_connection()
-    cur = conn.cursor()
-    
-    # Создание таблицы для анкет
-    cur.execute("""
-        CREATE TABLE IF NOT EXISTS applications (
-            id SERIAL PRIMARY KEY,
-            nickname VARCHAR(100) NOT NULL,
-            rank VARCHAR(100) NOT NULL,
-            name VARCHAR(100),
-            contact VARCHAR(200) NOT NULL,
-            team VARCHAR(100),
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    """)
-    
-    conn.commit()
-    cur.close()
-    conn.close()
-
-def save_application(nickname, rank, name, contact, team):
-    """Сохранение анкеты в базу данных"""
-    conn = get_db_connection()
-    cur = conn.cursor()
-    
-    cur.execute("""
-        INSERT INTO applications (nickname, rank, name, contact, team)
-        VALUES (%s, %s, %s, %s, %s)
-        RETURNING id
-    """, (nickname, rank, name, contact, team))
-    
-    app_id = cur.fetchone()['id']
-    conn.commit()
-    cur.close()
-    conn.close()
-    return app_id
+    """Применение миграций схемы; при актуальной схеме - пара коротких запросов"""
+    global _trgm_available
+    with db_cursor() as cur:
+        applied = migrate(cur)
+    _trgm_available = SEARCH_MIGRATION in applied
+
+# Есть ли pg_trgm: без него поиск идёт только по подстроке
+_trgm_available = False
+
+# Длины столбцов анкеты (nickname, rank, name, contact, team) из миграции 1
+APPLICATION_FIELD_LIMITS = (100, 100, 100, 200, 100)
+
+def _fit(value, limit):
+    # Postgres не принимает NUL в строках, а длинный ответ на "расскажите о себе" - в VARCHAR(100)
+    if value is None:
+        return None
+    return str(value).replace("\x00", "")[:limit]
+
+def _prepare_row(row):
+    """Строка анкеты в виде (ник, ранг, имя, контакт, команда, user_id, created_at) с обрезанными полями"""
+    # Строки из старых журналов записаны без user_id и created_at
+    row = tuple(row) + (None,) * (7 - len(row))
+    fields = tuple(_fit(value, limit) for value, limit in zip(row, APPLICATION_FIELD_LIMITS))
+    return fields + row[5:7]
+
+# Повторная заявка обновляет существующую запись и получает её ID. Версия,
+# поданная раньше той, что уже в записи (анкета из локального буфера, дописанная
+# после восстановления БД), запись не меняет, но ID получает
+_NEWER_VERSION = "COALESCE(applications.submitted_at, applications.created_at) <= EXCLUDED.submitted_at"
+UPSERT_CONFLICT = """
+    ON CONFLICT (tournament_id, dedup_key) DO UPDATE SET
+        """ + ",\n        ".join(
+    f"{column} = CASE WHEN {_NEWER_VERSION} THEN EXCLUDED.{column} ELSE applications.{column} END"
+    for column in ('nickname', 'rank', 'name', 'contact', 'team', 'submitted_at')
+) + """,
+        user_id = COALESCE(EXCLUDED.user_id, applications.user_id)
+    RETURNING id, dedup_key, (xmax = 0) AS inserted
+"""
+
+# Турнир, открытый в момент подачи анкеты (%s - время подачи, дважды): анкета,
+# пролежавшая в буфере до закрытия турнира, попадает в его архив, а не в новый.
+# Время подачи берётся по часам бота, границы турниров - по часам БД
+TOURNAMENT_AT = f"""COALESCE(
+    (SELECT id FROM tournaments WHERE closed_at > %s::timestamptz AND created_at <= %s::timestamptz
+     ORDER BY created_at DESC LIMIT 1),
+    {ACTIVE_TOURNAMENT})"""
+
+def _update_stats_after_upsert(saved, teams_by_key):
+    if all(row['inserted'] for row in saved):
+        _stats_cache.add([teams_by_key[row['dedup_key']] for row in saved])
+    else:
+        # У обновлённой записи могла смениться команда - проще пересчитать
+        _stats_cache.invalidate()
+
+def save_application(nickname, rank, name, contact, team, user_id=None):
+    """Сохранение анкеты в базу данных (повторная заявка обновляет прежнюю)"""
+    nickname, rank, name, contact, team, user_id, _ = _prepare_row((nickname, rank, name, contact, team, user_id))
+    key = normalize_key(nickname, contact)
+    with db_cursor() as cur:
+        cur.execute(f"""
+            INSERT INTO applications (nickname, rank, name, contact, team, user_id, dedup_key, tournament_id, submitted_at)
+            VALUES (%s, %s, %s, %s, %s, %s, %s, {ACTIVE_TOURNAMENT}, CURRENT_TIMESTAMP)
+        """ + UPSERT_CONFLICT, (nickname, rank, name, contact, team, user_id, key))
+        saved = cur.fetchone()
+    _update_stats_after_upsert([saved], {key: team})
+    return saved['id']
+
+def save_applications_batch(rows):
+    """Сохранение нескольких анкет одним INSERT, ID возвращаются в порядке rows.
+
+    Строка - (ник, ранг, имя, контакт, команда[, user_id[, created_at]]).
+    created_at - время подачи анкеты (datetime с часовым поясом), если она
+    пишется с опозданием; без него берётся текущее время. Такая анкета идёт
+    в турнир, открытый в момент подачи, и не затирает поданную позже версию.
+    """
+    rows = [_prepare_row(row) for row in rows]
+    # Внутри одного INSERT ... ON CONFLICT ключи должны быть уникальны - последняя версия побеждает
+    keys = [normalize_key(row[0], row[3]) for row in rows]
+    # Время подачи нужно в created_at, submitted_at и дважды для выбора турнира
+    unique = {key: row[:6] + (row[6], row[6], key, row[6], row[6]) for key, row in zip(keys, rows)}
+    with db_cursor() as cur:
+        saved = execute_values(cur, """
+            INSERT INTO applications
+                (nickname, rank, name, contact, team, user_id, created_at, submitted_at, dedup_key, tournament_id)
+            VALUES %s
+        """ + UPSERT_CONFLICT, list(unique.values()),
+            template="(%s, %s, %s, %s, %s, %s, COALESCE(%s::timestamptz, CURRENT_TIMESTAMP), "
+                     f"COALESCE(%s::timestamptz, CURRENT_TIMESTAMP), %s, {TOURNAMENT_AT})",
+            page_size=max(len(unique), 1), fetch=True)
+    _update_stats_after_upsert(saved, {key: row[4] for key, row in unique.items()})
+    ids_by_key = {row['dedup_key']: row['id'] for row in saved}
+    return [ids_by_key[key] for key in keys]
+
+def save_applications_checked(rows):
+    """save_applications_batch, в котором строка с ошибкой данных не мешает остальным.
+
+    Если пачка не записалась не из-за соединения, строки пишутся по одной.
+    Возвращает список той же длины: ID анкеты или исключение для строки,
+    которую БД не принимает. TRANSIENT_ERRORS пробрасываются - пачку нужно
+    повторить позже целиком (повтор безопасен благодаря ON CONFLICT).
+    """
+    try:
+        return save_applications_batch(rows)
+    except TRANSIENT_ERRORS:
+        raise
+    except Exception as e:
+        if len(rows) == 1:
+            return [e]
+    results = []
+    for row in rows:
+        try:
+            results.append(save_applications_batch([row])[0])
+        except TRANSIENT_ERRORS:
+            raise
+        except Exception as e:
+            results.append(e)
+    return results
 
 def get_stats():
-    """Получение статистики"""
-    conn = get_db_connection()
-    cur = conn.cursor()
-    
-    # Общее количество анкет
-    cur.execute("SELECT COUNT(*) as count FROM applications")
-    total = cur.fetchone()['count']
-    
-    # Количество анкет по командам
-    cur.execute("""
-        SELECT team, COUNT(*) as count 
-        FROM applications 
-        WHERE team != 'Нет' AND team IS NOT NULL
-        GROUP BY team
-        ORDER BY count DESC
-    """)
-    teams = cur.fetchall()
-    
-    cur.close()
-    conn.close()
+    """Получение статистики текущего турнира (из кэша, если он актуален)"""
+    cached = _stats_cache.get()
+    if cached is not None:
+        return cached
+
+    generation = _stats_cache.generation
+    with db_cursor() as cur:
+        # Общее количество анкет
+        cur.execute(f"SELECT COUNT(*) as count FROM applications WHERE tournament_id = {ACTIVE_TOURNAMENT}")
+        total = cur.fetchone()['count']
+
+        # Количество анкет по командам
+        cur.execute(f"""
+            SELECT team, COUNT(*) as count
+            FROM applications
+            WHERE tournament_id = {ACTIVE_TOURNAMENT} AND team != 'Нет' AND team IS NOT NULL
+            GROUP BY team
+            ORDER BY count DESC
+        """)
+        teams = cur.fetchall()
+    _stats_cache.load(total, teams, generation)
     return total, teams
 
 def get_all_applications():
-    """Получение всех анкет"""
-    conn = get_db_connection()
-    cur = conn.cursor()
-    
-    cur.execute("""
-        SELECT id, nickname, rank, name, contact, team, created_at
-        FROM applications
-        ORDER BY created_at DESC
-    """)
-    applications = cur.fetchall()
-    
-    cur.close()
-    conn.close()
-    return applications
-
-def reset_applications():
-    """Очистка всех анкет"""
-    conn = get_db_connection()
-    cur = conn.cursor()
-    
-    cur.execute("DELETE FROM applications")
-    deleted_count = cur.rowcount
-    
-    conn.commit()
-    cur.close()
-    conn.close()
-    return deleted_count
+    """Получение всех анкет текущего турнира"""
+    with db_cursor() as cur:
+        cur.execute(f"""
+            SELECT id, nickname, rank, name, contact, team, created_at
+            FROM applications
+            WHERE tournament_id = {ACTIVE_TOURNAMENT}
+            ORDER BY created_at DESC, id DESC
+        """)
+        return cur.fetchall()
+
+def get_applications_page(cursor=None, limit=10, backward=False):
+    """Страница анкет текущего турнира по ключу (created_at, id), новые сначала.
+
+    cursor - пара (created_at, id) крайней записи предыдущей страницы.
+    При backward=True возвращаются записи новее курсора.
+    Возвращает (записи, есть_ли_ещё_записи_в_этом_направлении).
+    """
+    with db_cursor() as cur:
+        if cursor is None:
+            cur.execute(f"""
+                SELECT id, nickname, rank, name, contact, team, created_at
+                FROM applications
+                WHERE tournament_id = {ACTIVE_TOURNAMENT}
+                ORDER BY created_at DESC, id DESC
+                LIMIT %s
+            """, (limit + 1,))
+        elif backward:
+            cur.execute(f"""
+                SELECT id, nickname, rank, name, contact, team, created_at
+                FROM applications
+                WHERE tournament_id = {ACTIVE_TOURNAMENT} AND (created_at, id) > (%s, %s)
+                ORDER BY created_at ASC, id ASC
+                LIMIT %s
+            """, (cursor[0], cursor[1], limit + 1))
+        else:
+            cur.execute(f"""
+                SELECT id, nickname, rank, name, contact, team, created_at
+                FROM applications
+                WHERE tournament_id = {ACTIVE_TOURNAMENT} AND (created_at, id) < (%s, %s)
+                ORDER BY created_at DESC, id DESC
+                LIMIT %s
+            """, (cursor[0], cursor[1], limit + 1))
+        rows = cur.fetchall()
+
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    if backward:
+        rows.reverse()
+    return rows, has_more
+
+def get_applications_by_ids(app_ids):
+    """Получение анкет текущего турнира по списку ID"""
+    with db_cursor() as cur:
+        cur.execute(f"""
+            SELECT id, nickname, rank, name, contact, team, created_at
+            FROM applications
+            WHERE id = ANY(%s) AND tournament_id = {ACTIVE_TOURNAMENT}
+            ORDER BY created_at DESC, id DESC
+        """, (list(app_ids),))
+        return cur.fetchall()
+
+def _escape_like(text):
+    return text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+def search_applications(query, limit=10):
+    """Поиск анкет текущего турнира по нику, имени, контакту и команде.
+
+    Сначала идут записи, где запрос встречается подстрокой, затем похожие
+    по триграммам (опечатки, часть слова). Возвращает записи с полем score.
+    """
+    query = query.strip().lower()
+    like = f"%{_escape_like(query)}%"
+    with db_cursor() as cur:
+        if _trgm_available:
+            cur.execute(f"""
+                SELECT id, nickname, rank, name, contact, team, created_at,
+                       CASE WHEN {SEARCH_DOCUMENT} LIKE %(like)s THEN 1.0
+                            ELSE word_similarity(%(query)s, {SEARCH_DOCUMENT}) END AS score
+                FROM applications
+                WHERE tournament_id = {ACTIVE_TOURNAMENT}
+                  AND ({SEARCH_DOCUMENT} LIKE %(like)s OR %(query)s <%% {SEARCH_DOCUMENT})
+                ORDER BY score DESC, created_at DESC, id DESC
+                LIMIT %(limit)s
+            """, {'query': query, 'like': like, 'limit': limit})
+        else:
+            cur.execute(f"""
+                SELECT id, nickname, rank, name, contact, team, created_at, 1.0 AS score
+                FROM applications
+                WHERE tournament_id = {ACTIVE_TOURNAMENT} AND {SEARCH_DOCUMENT} LIKE %(like)s
+                ORDER BY created_at DESC, id DESC
+                LIMIT %(limit)s
+            """, {'like': like, 'limit': limit})
+        return cur.fetchall()
+
+def close_tournament(title=None):
+    """Закрытие текущего турнира и открытие нового.
+
+    Заявки не удаляются, а остаются в архиве закрытого турнира,
+    поэтому это два маленьких UPDATE/INSERT вместо DELETE по всей таблице.
+    Возвращает число заявок в закрытом турнире.
+    """
+    with db_cursor() as cur:
+        cur.execute("SELECT id FROM tournaments WHERE closed_at IS NULL FOR UPDATE")
+        active = cur.fetchone()
+        archived = 0
+        if active:
+            cur.execute("SELECT COUNT(*) AS count FROM applications WHERE tournament_id = %s", (active['id'],))
+            archived = cur.fetchone()['count']
+            cur.execute("UPDATE tournaments SET closed_at = CURRENT_TIMESTAMP WHERE id = %s", (active['id'],))
+        cur.execute("INSERT INTO tournaments (title) VALUES (%s)", (title,))
+    _stats_cache.clear()
+    return archived
 
 def delete_application_by_id(app_id):
-    """Удаление анкеты по ID"""
-    conn = get_db_connection()
-    cur = conn.cursor()
-    cur.execute("DELETE FROM applications WHERE id = %s", (app_id,))
-    deleted = cur.rowcount
-    conn.commit()
-    cur.close()
-    conn.close()
-    return deleted
+    """Удаление анкеты текущего турнира по ID"""
+    return delete_applications_by_ids([app_id])
+
+def delete_applications_by_ids(app_ids):
+    """Удаление нескольких анкет текущего турнира за один запрос"""
+    with db_cursor() as cur:
+        cur.execute(f"""
+            DELETE FROM applications
+            WHERE id = ANY(%s) AND tournament_id = {ACTIVE_TOURNAMENT}
+            RETURNING team
+        """, (list(app_ids),))
+        deleted = cur.fetchall()
+    _stats_cache.remove([row['team'] for row in deleted])
+    return len(deleted)
+
+# === Рассылки ===
+BROADCAST_COLUMNS = "id, tournament_id, text, admin_chat_id, progress_message_id, last_user_id, sent, failed"
+
+def count_broadcast_recipients():
+    """Сколько разных пользователей в текущем турнире можно оповестить"""
+    with db_cursor() as cur:
+        cur.execute(f"""
+            SELECT COUNT(DISTINCT user_id) AS count FROM applications
+            WHERE tournament_id = {ACTIVE_TOURNAMENT} AND user_id IS NOT NULL
+        """)
+        return cur.fetchone()['count']
+
+def create_broadcast(text, admin_chat_id, progress_message_id, lease):
+    """Новое задание рассылки по текущему турниру, сразу занятое этим процессом на lease секунд"""
+    with db_cursor() as cur:
+        cur.execute(f"""
+            INSERT INTO broadcasts (tournament_id, text, admin_chat_id, progress_message_id, locked_until)
+            VALUES ({ACTIVE_TOURNAMENT}, %s, %s, %s, NOW() + %s * INTERVAL '1 second')
+            RETURNING {BROADCAST_COLUMNS}
+        """, (text, admin_chat_id, progress_message_id, lease))
+        return cur.fetchone()
+
+def claim_broadcasts(lease):
+    """Незавершённые рассылки, которые никто не ведёт (процесс упал или перезапущен).
+
+    Занимаются на lease секунд; пока процесс жив, он продлевает срок при каждом сохранении прогресса.
+    """
+    with db_cursor() as cur:
+        cur.execute(f"""
+            UPDATE broadcasts SET locked_until = NOW() + %s * INTERVAL '1 second'
+            WHERE status = 'running' AND (locked_until IS NULL OR locked_until < NOW())
+            RETURNING {BROADCAST_COLUMNS}
+        """, (lease,))
+        return cur.fetchall()
+
+def get_broadcast_recipients(tournament_id, after_user_id, limit):
+    """Следующая порция получателей по возрастанию user_id (курсор - последний обработанный)"""
+    with db_cursor() as cur:
+        cur.execute("""
+            SELECT DISTINCT user_id FROM applications
+            WHERE tournament_id = %s AND user_id > %s
+            ORDER BY user_id
+            LIMIT %s
+        """, (tournament_id, after_user_id, limit))
+        return [row['user_id'] for row in cur.fetchall()]
+
+def save_broadcast_progress(broadcast_id, last_user_id, sent, failed, lease, status='running'):
+    """Сохранение курсора и счётчиков рассылки с продлением срока занятости"""
+    with db_cursor() as cur:
+        cur.execute("""
+            UPDATE broadcasts SET
+                last_user_id = %s, sent = %s, failed = %s, status = %s,
+                locked_until = NOW() + %s * INTERVAL '1 second',
+                finished_at = CASE WHEN %s = 'running' THEN NULL ELSE CURRENT_TIMESTAMP END
+            WHERE id = %s
+        """, (last_user_id, sent, failed, status, lease, status, broadcast_id))
+
+# === Выгрузка ===
+EXPORT_QUERY = f"""
+    SELECT id, nickname, rank, name, contact, team, created_at
+    FROM applications
+    WHERE tournament_id = {ACTIVE_TOURNAMENT}
+    ORDER BY created_at DESC, id DESC
+"""
+
+def copy_applications_csv(fileobj):
+    """Выгрузка анкет текущего турнира в CSV через COPY TO STDOUT, без загрузки в память"""
+    with get_pool().connection() as conn:
+        with conn.cursor() as cur:
+            # Выгрузка большой таблицы может идти дольше обычного таймаута
+            cur.execute("SET LOCAL statement_timeout = 0")
+            cur.copy_expert(f"COPY ({EXPORT_QUERY}) TO STDOUT WITH (FORMAT csv, HEADER true)", fileobj)
+
+def iter_applications(batch_size=2000):
+    """Обход анкет текущего турнира через серверный (именованный) курсор порциями по batch_size"""
+    with get_pool().connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("SET LOCAL statement_timeout = 0")
+        with conn.cursor(name="applications_export") as cur:
+            cur.itersize = batch_size
+            cur.execute(EXPORT_QUERY)
+            for row in cur:
+                yield row
@@ -0,0 +1,57 @@
+# dedup.py
+import os
+import re
+import time
+from collections import OrderedDict
+
+# Сколько секунд после заявки повторная регистрация отклоняется без запроса к БД
+DEDUP_WINDOW = int(os.environ.get('DEDUP_WINDOW', '600'))
+# Сколько недавних заявок помнить
+DEDUP_CACHE_SIZE = int(os.environ.get('DEDUP_CACHE_SIZE', '10000'))
+
+_CONTACT_PREFIX = re.compile(r'^(https?://)?(www\.)?(t\.me/|telegram\.me/)?@?')
+_SPACES = re.compile(r'\s+')
+
+
+def normalize_key(nickname, contact):
+    """Ключ для поиска дублей: ник и контакт без регистра, пробелов и префиксов t.me/@"""
+    nickname = _SPACES.sub(' ', (nickname or '').strip()).casefold()
+    contact = _CONTACT_PREFIX.sub('', (contact or '').strip().casefold()).rstrip('/')
+    return f"{nickname}|{contact}"
+
+
+class RecentSubmissions:
+    """LRU недавних заявок: по ID пользователя Telegram и по ключу ник+контакт"""
+
+    def __init__(self, window=DEDUP_WINDOW, size=DEDUP_CACHE_SIZE):
+        self.window = window
+        self.size = size
+        self._entries = OrderedDict()  # ключ -> (ID заявки, время)
+
+    def remember(self, app_id, *keys):
+        now = time.monotonic()
+        for key in keys:
+            self._entries[key] = (app_id, now)
+            self._entries.move_to_end(key)
+        while len(self._entries) > self.size:
+            self._entries.popitem(last=False)
+
+    def find(self, key):
+        """Пара (ID заявки, время) или None, если заявки не было или окно истекло"""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        app_id, saved_at = entry
+        if time.monotonic() - saved_at > self.window:
+            del self._entries[key]
+            return None
+        return entry
+
+    def forget_ids(self, app_ids):
+        """Забыть удалённые заявки: и по ID пользователя, и по ключу ник+контакт"""
+        app_ids = set(app_ids)
+        for key in [key for key, (app_id, _) in self._entries.items() if app_id in app_ids]:
+            del self._entries[key]
+
+    def clear(self):
+        self._entries.clear()
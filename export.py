@@ -0,0 +1,71 @@
+# export.py
+import os
+import zipfile
+import tempfile
+
+from database import copy_applications_csv, iter_applications
+
+# XLSX - необязательная зависимость
+try:
+    from openpyxl import Workbook
+    XLSX_AVAILABLE = True
+except ImportError:
+    XLSX_AVAILABLE = False
+
+# Боты не могут отправлять файлы больше 50 МБ
+TELEGRAM_FILE_LIMIT = 50 * 1024 * 1024
+
+EXPORT_COLUMNS = ('id', 'nickname', 'rank', 'name', 'contact', 'team', 'created_at')
+
+
+def _write_csv(path):
+    with open(path, "wb") as f:
+        # BOM, чтобы Excel правильно открыл кириллицу
+        f.write(b"\xef\xbb\xbf")
+        copy_applications_csv(f)
+
+
+def _write_xlsx(path):
+    # write_only: строки сразу уходят на диск, память не растёт
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet("Заявки")
+    sheet.append(EXPORT_COLUMNS)
+    for row in iter_applications():
+        sheet.append([row[column] for column in EXPORT_COLUMNS])
+    workbook.save(path)
+
+
+def _zip(path, arcname):
+    zip_path = path + ".zip"
+    with zipfile.ZipFile(zip_path, "w", compression=zipfile.ZIP_DEFLATED) as archive:
+        archive.write(path, arcname)
+    os.remove(path)
+    return zip_path
+
+
+def export_applications(fmt):
+    """Выгрузка анкет во временный файл. Возвращает (путь, имя файла для отправки).
+
+    Файл нужно удалить после отправки.
+    """
+    if fmt == "xlsx" and not XLSX_AVAILABLE:
+        raise RuntimeError("Для XLSX нужен пакет openpyxl")
+    fd, path = tempfile.mkstemp(suffix="." + fmt)
+    os.close(fd)
+    filename = f"applications.{fmt}"
+    try:
+        if fmt == "xlsx":
+            _write_xlsx(path)
+        else:
+            _write_csv(path)
+        if os.path.getsize(path) > TELEGRAM_FILE_LIMIT and fmt == "csv":
+            path = _zip(path, filename)
+            filename += ".zip"
+        if os.path.getsize(path) > TELEGRAM_FILE_LIMIT:
+            raise RuntimeError("Файл выгрузки больше 50 МБ")
+    except BaseException:
+        for leftover in (path, path + ".zip"):
+            if os.path.exists(leftover):
+                os.remove(leftover)
+        raise
+    return path, filename
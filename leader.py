@@ -0,0 +1,153 @@
+# leader.py
+import os
+import time
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Ключ advisory-блокировки Postgres, общий для всех реплик бота
+LEADER_LOCK_KEY = int(os.environ.get('LEADER_LOCK_KEY', '7245601'))
+# Как часто резервная реплика пытается стать лидером и лидер проверяет блокировку
+LEADER_CHECK_INTERVAL = float(os.environ.get('LEADER_CHECK_INTERVAL', '5'))
+# Сколько секунд подряд база может не отвечать при запуске, прежде чем бот запустится без неё
+LEADER_CONNECT_TIMEOUT = float(os.environ.get('LEADER_CONNECT_TIMEOUT', '30'))
+
+
+class PidFileLock:
+    """Блокировка через файл с PID для запуска без базы данных"""
+
+    def __init__(self, path):
+        self.path = path
+
+    @staticmethod
+    def _is_running(pid):
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            # Процесс есть, но принадлежит другому пользователю
+            return True
+        return True
+
+    def try_acquire(self):
+        if os.path.exists(self.path):
+            try:
+                with open(self.path, encoding="utf-8") as f:
+                    pid = int(f.read().strip())
+            except (OSError, ValueError):
+                pid = None
+            if pid and pid != os.getpid() and self._is_running(pid):
+                return False
+            # Процесс из файла уже не работает (например, убит через SIGKILL)
+            logger.warning(f"Удаляем устаревший файл блокировки (PID {pid})")
+            os.remove(self.path)
+        try:
+            fd = os.open(self.path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            # Другой процесс успел создать файл раньше нас
+            return False
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(str(os.getpid()))
+        return True
+
+    def is_held(self):
+        return True
+
+    def release(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class AdvisoryLeaderLock:
+    """Лидерство через pg_try_advisory_lock на отдельном соединении.
+
+    Блокировка живёт, пока живо соединение: если процесс лидера умер,
+    Postgres снимает её сам, и её забирает одна из резервных реплик.
+    """
+
+    def __init__(self, key=LEADER_LOCK_KEY):
+        self.key = key
+        self._conn = None
+
+    def try_acquire(self):
+        from database import get_db_connection
+        conn = get_db_connection()
+        conn.autocommit = True
+        with conn.cursor() as cur:
+            cur.execute("SELECT pg_try_advisory_lock(%s) AS locked", (self.key,))
+            locked = cur.fetchone()['locked']
+        if not locked:
+            conn.close()
+            return False
+        self._conn = conn
+        return True
+
+    def is_held(self):
+        if self._conn is None or self._conn.closed:
+            return False
+        try:
+            with self._conn.cursor() as cur:
+                cur.execute("SELECT 1")
+            return True
+        except Exception:
+            self._conn.close()
+            return False
+
+    def release(self):
+        if self._conn is not None and not self._conn.closed:
+            try:
+                with self._conn.cursor() as cur:
+                    cur.execute("SELECT pg_advisory_unlock(%s)", (self.key,))
+            finally:
+                self._conn.close()
+        self._conn = None
+
+
+def wait_for_leadership(lock, interval=LEADER_CHECK_INTERVAL, connect_timeout=LEADER_CONNECT_TIMEOUT):
+    """Ожидание лидерства: резервная реплика ждёт, пока блокировка освободится.
+
+    Возвращает True, когда блокировка получена. Если база не отвечает
+    connect_timeout секунд подряд, возвращает False: занятая блокировка и
+    недоступная база - разные случаи, и во втором ждать бесконечно нельзя.
+    """
+    announced = False
+    unreachable_since = None
+    while True:
+        try:
+            if lock.try_acquire():
+                return True
+        except Exception as e:
+            now = time.monotonic()
+            if unreachable_since is None:
+                unreachable_since = now
+            if now - unreachable_since >= connect_timeout:
+                logger.error(f"❌ База не отвечает {connect_timeout:.0f} с, блокировку лидера получить нельзя: {e}")
+                return False
+            logger.error(f"Ошибка получения блокировки лидера: {e}")
+        else:
+            # База ответила: блокировку держит другая реплика
+            unreachable_since = None
+            if not announced:
+                logger.info("⏳ Апдейты уже обрабатывает другая реплика, ждём в резерве")
+                announced = True
+        time.sleep(interval)
+
+
+async def watch_leadership(lock, on_lost, interval=LEADER_CHECK_INTERVAL):
+    """Периодическая проверка, что блокировка всё ещё наша"""
+    while True:
+        await asyncio.sleep(interval)
+        if await asyncio.to_thread(lock.is_held):
+            continue
+        # Соединение оборвалось - пробуем вернуть блокировку, пока её не забрали
+        try:
+            if await asyncio.to_thread(lock.try_acquire):
+                logger.warning("Соединение блокировки лидера восстановлено")
+                continue
+        except Exception as e:
+            logger.error(f"Ошибка восстановления блокировки лидера: {e}")
+        logger.error("❌ Лидерство потеряно, останавливаем обработку апдейтов")
+        on_lost()
+        return
@@ -0,0 +1,856 @@
+# loadtest.py
+"""Нагрузочный тест бота без Telegram.
+
+Запросы к Bot API уходят в FakeRequest, апдейты по умолчанию подаются
+прямо в update_processor приложения, как их подаёт Application.
+N пользователей одновременно проходят регистрацию, админы в это время
+жмут «Статистика» и «Все участники».
+
+Без DATABASE_URL используется хранилище в памяти с искусственной
+задержкой запросов (--db-latency), с DATABASE_URL - настоящий Postgres.
+
+    python loadtest.py --users 500 --admins 2 --api-latency 30 --db-latency 5
+
+С --startup N вместо нагрузки N раз замеряется запуск бота: миграции
+идут в фоне одновременно с инициализацией PTB (getMe и т.п.).
+
+    python loadtest.py --startup 5 --api-latency 100
+
+С --callbacks N админ N раз проходит по экранам «Статистика» и «Все
+участники», нажимая каждую кнопку дважды; повторное нажатие не должно
+доходить до Bot API, если экран не изменился.
+
+    python loadtest.py --callbacks 2000 --users 100 --api-latency 0 --db-latency 0
+
+С --export N замеряется выгрузка N анкет (--export-format csv или xlsx):
+время, размер файла и пиковая память процесса. Без DATABASE_URL анкеты
+генерируются на лету вместо COPY и серверного курсора, с DATABASE_URL
+выгружается текущий турнир из Postgres.
+
+    python loadtest.py --export 1000000 --export-format xlsx
+
+С --compare нагрузка прогоняется в нескольких вариантах, в конце -
+общая таблица: апдейты и анкеты в секунду, p99, запросы к Bot API,
+соединения с БД.
+
+--compare concurrency сравнивает обработку строго по одному апдейту и
+по 32 одновременно.
+
+    python loadtest.py --compare concurrency --users 300 --api-latency 30
+
+--compare webhook сравнивает доставку через Updater: polling, где бот
+забирает апдейты через getUpdates, и вебхук-сервер PTB на локальном
+порту, куда апдейты приходят POST-запросами с заголовком
+X-Telegram-Bot-Api-Secret-Token. С --transport polling или webhook
+так же идёт и обычный прогон.
+
+    python loadtest.py --compare webhook --users 500 --concurrency 250
+
+--compare slow-query сравнивает задержки обработчиков без медленного
+запроса и пока админ непрерывно выгружает анкеты (каждая выгрузка
+держит поток БД --slow-query секунд).
+
+    python loadtest.py --compare slow-query --users 2000 --concurrency 500 --slow-query 5
+
+--compare write-behind сравнивает запись анкет по одной и пачками
+(WRITE_BEHIND): анкеты в секунду и p99 последнего шага регистрации.
+
+    python loadtest.py --compare write-behind --users 1000 --concurrency 500 --db-latency 100
+
+--compare pool сравнивает пул соединений с соединением на каждый вызов
+БД: запросы в секунду, p99 и сколько соединений открыто (в секунду и на
+апдейт). Работает только с настоящим Postgres.
+
+    DATABASE_URL=postgresql://localhost/bot python loadtest.py --compare pool --users 1000
+"""
+import io
+import os
+import sys
+import csv
+import json
+import socket
+import tempfile
+import time
+import asyncio
+import argparse
+import resource
+import itertools
+import threading
+from datetime import datetime, timedelta
+
+# Настройки бота нужно задать до его импорта
+ADMIN_IDS = [900000001, 900000002, 900000003, 900000004]
+os.environ.setdefault('BOT_TOKEN', '123456:LOADTEST')
+os.environ['ADMIN_IDS'] = ",".join(str(x) for x in ADMIN_IDS)
+os.environ.setdefault('PERSISTENCE_BACKEND', 'none')
+os.environ.setdefault('METRICS_PORT', '0')
+os.environ.setdefault('LOCAL_BUFFER_PATH', ':memory:')
+os.environ.setdefault('WRITE_BEHIND_JOURNAL', os.path.join(tempfile.gettempdir(), 'loadtest.journal'))
+
+from telegram import Update
+from telegram.request import BaseRequest
+
+import bot
+import export
+import write_behind
+from dedup import normalize_key
+
+
+class FakeRequest(BaseRequest):
+    """Ответы Bot API без сети, с задержкой latency секунд на запрос"""
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.calls = 0
+        self.edits = 0
+        # Последнее отправленное в каждый чат сообщение - то, что видит пользователь
+        self.screens = {}
+        self._message_ids = itertools.count(1)
+        # Апдейты для getUpdates, когда бот работает через polling
+        self.incoming = []
+        self.polls = 0
+        self._incoming_ready = asyncio.Event()
+
+    def push_update(self, payload):
+        self.incoming.append(payload)
+        self._incoming_ready.set()
+
+    async def _get_updates(self, params):
+        """Long polling: ответ сразу, если апдейты есть, иначе по их приходу или по таймауту"""
+        self.polls += 1
+        if not self.incoming:
+            try:
+                await asyncio.wait_for(self._incoming_ready.wait(), float(params.get("timeout") or 0))
+            except asyncio.TimeoutError:
+                pass
+        limit = int(params.get("limit") or 100)
+        result, self.incoming = self.incoming[:limit], self.incoming[limit:]
+        if not self.incoming:
+            self._incoming_ready.clear()
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return result
+
+    @property
+    def read_timeout(self):
+        return None
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    async def do_request(self, url, method, request_data=None, *args, **kwargs):
+        api_method = url.rsplit("/", 1)[-1]
+        params = request_data.parameters if request_data else {}
+        if api_method == "getUpdates":
+            # Опросы считаются отдельно: в calls - только ответы бота
+            result = await self._get_updates(params)
+            return 200, json.dumps({"ok": True, "result": result}).encode()
+        self.calls += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if api_method == "getMe":
+            result = {"id": 1, "is_bot": True, "first_name": "LoadTest", "username": "loadtest_bot"}
+        elif api_method in ("sendMessage", "editMessageText", "sendDocument"):
+            result = {
+                "message_id": next(self._message_ids),
+                "date": int(time.time()),
+                "chat": {"id": int(params.get("chat_id", 1)), "type": "private"},
+                # Как и Telegram, пробелы по краям текста отбрасываются
+                "text": params.get("text", "").strip(),
+            }
+            if "reply_markup" in params:
+                result["reply_markup"] = params["reply_markup"]
+            if api_method == "editMessageText":
+                self.edits += 1
+            self.screens[result["chat"]["id"]] = result
+        else:
+            result = True
+        return 200, json.dumps({"ok": True, "result": result}).encode()
+
+
+# === Хранилище в памяти вместо database.py ===
+class MemoryStore:
+    """Те же функции, что и в database.py, с задержкой latency секунд"""
+
+    def __init__(self, latency=0.0, slow=0.0):
+        self.latency = latency
+        # Сколько идёт выгрузка - медленный запрос для --compare slow-query
+        self.slow = slow
+        self.rows = {}
+        self._ids_by_key = {}
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def _wait(self):
+        if self.latency:
+            time.sleep(self.latency)
+
+    def init_db(self):
+        # Схема уже актуальна: как и в migrations.py, два коротких запроса
+        self._wait()
+        self._wait()
+
+    def save_application(self, nickname, rank, name, contact, team, user_id=None):
+        self._wait()
+        return self._insert(nickname, rank, name, contact, team, user_id)
+
+    def save_applications_checked(self, rows):
+        """Пачка анкет одним запросом: задержка одна на всю пачку"""
+        self._wait()
+        return [self._insert(*row[:6]) for row in rows]
+
+    def _insert(self, nickname, rank, name, contact, team, user_id):
+        key = normalize_key(nickname, contact)
+        with self._lock:
+            # Как ON CONFLICT в database.py: повтор обновляет прежнюю запись
+            app_id = self._ids_by_key.get(key)
+            if app_id not in self.rows:
+                app_id = self._ids_by_key[key] = next(self._ids)
+            self.rows[app_id] = {
+                'id': app_id, 'nickname': nickname, 'rank': rank, 'name': name,
+                'contact': contact, 'team': team,
+                'created_at': datetime(2024, 1, 1) + timedelta(microseconds=app_id),
+                'dedup_key': key, 'user_id': user_id,
+            }
+        return app_id
+
+    def get_stats(self):
+        self._wait()
+        with self._lock:
+            teams = {}
+            for row in self.rows.values():
+                if row['team'] is not None and row['team'] != 'Нет':
+                    teams[row['team']] = teams.get(row['team'], 0) + 1
+            total = len(self.rows)
+        ordered = sorted(teams.items(), key=lambda item: -item[1])
+        return total, [{'team': team, 'count': count} for team, count in ordered]
+
+    def get_applications_page(self, cursor=None, limit=10, backward=False):
+        self._wait()
+        with self._lock:
+            rows = sorted(self.rows.values(), key=lambda r: (r['created_at'], r['id']), reverse=True)
+        if cursor is not None:
+            if backward:
+                rows = [r for r in rows if (r['created_at'], r['id']) > cursor][::-1]
+            else:
+                rows = [r for r in rows if (r['created_at'], r['id']) < cursor]
+        page = rows[:limit]
+        if backward:
+            page.reverse()
+        return page, len(rows) > limit
+
+    def get_applications_by_ids(self, app_ids):
+        self._wait()
+        with self._lock:
+            return [self.rows[i] for i in app_ids if i in self.rows]
+
+    def get_all_applications(self):
+        self._wait()
+        with self._lock:
+            return sorted(self.rows.values(), key=lambda r: (r['created_at'], r['id']), reverse=True)
+
+    def search_applications(self, query, limit=10):
+        self._wait()
+        query = query.strip().lower()
+        matches = [
+            dict(row, score=1.0) for row in self.get_all_applications()
+            if query in " ".join(row[f] or "" for f in ('nickname', 'name', 'contact', 'team')).lower()
+        ]
+        return matches[:limit]
+
+    def delete_applications_by_ids(self, app_ids):
+        self._wait()
+        with self._lock:
+            return sum(1 for i in app_ids if self.rows.pop(i, None))
+
+    def export_applications(self, fmt):
+        """Выгрузка, как в export.py, но занимающая поток не меньше slow секунд"""
+        started = time.monotonic()
+        fd, path = tempfile.mkstemp(suffix="." + fmt)
+        with os.fdopen(fd, "w", encoding="utf-8", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(export.EXPORT_COLUMNS)
+            for row in self.get_all_applications():
+                writer.writerow([row[column] for column in export.EXPORT_COLUMNS])
+        time.sleep(max(0.0, self.slow - (time.monotonic() - started)))
+        return path, f"applications.{fmt}"
+
+    def close_tournament(self, title=None):
+        self._wait()
+        with self._lock:
+            # Архив в памяти не нужен: закрытый турнир просто забывается
+            count = len(self.rows)
+            self.rows.clear()
+            self._ids_by_key.clear()
+        return count
+
+
+def install_memory_store(store):
+    """Подмена функций database.py в модуле bot.
+
+    Вызовы идут через настоящий run_db: его пул потоков, таймауты и
+    ограничение очереди - часть замера.
+    """
+    bot.DATABASE_AVAILABLE = True
+    bot.WRITE_BEHIND_ENABLED = False
+    write_behind.save_applications_checked = store.save_applications_checked
+    for name in ('init_db', 'save_application', 'get_stats', 'get_applications_page', 'get_applications_by_ids',
+                 'get_all_applications', 'search_applications', 'delete_applications_by_ids',
+                 'close_tournament', 'export_applications'):
+        setattr(bot, name, getattr(store, name))
+
+
+# === Генерация апдейтов ===
+_update_ids = itertools.count(1)
+
+def _user(user_id):
+    return {"id": user_id, "is_bot": False, "first_name": f"user{user_id}"}
+
+def message_update(user_id, text):
+    message = {
+        "message_id": next(_update_ids),
+        "date": int(time.time()),
+        "chat": {"id": user_id, "type": "private"},
+        "from": _user(user_id),
+        "text": text,
+    }
+    if text.startswith("/"):
+        message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+    return {"update_id": next(_update_ids), "message": message}
+
+def callback_update(user_id, data, message=None):
+    """Нажатие кнопки под message; по умолчанию - под админ-меню без клавиатуры"""
+    if message is None:
+        message = {
+            "message_id": next(_update_ids),
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"},
+            "text": "👑 Админ-панель",
+        }
+    return {
+        "update_id": next(_update_ids),
+        "callback_query": {
+            "id": str(next(_update_ids)),
+            "from": _user(user_id),
+            "chat_instance": str(user_id),
+            "data": data,
+            "message": message,
+        },
+    }
+
+
+# === Доставка апдейтов боту ===
+class DirectTransport:
+    """Апдейт сразу в update_processor, как его передаёт Application, без сети"""
+
+    def __init__(self, request=None):
+        pass
+
+    async def start(self, application):
+        pass
+
+    async def stop(self, application):
+        pass
+
+    async def deliver(self, application, payload):
+        update = Update.de_json(payload, application.bot)
+        await application.update_processor.process_update(update, application.process_update(update))
+
+
+class QueuedTransport(DirectTransport):
+    """Апдейт попадает в update_queue через Updater; deliver ждёт конца его обработки"""
+
+    def __init__(self, request):
+        self.request = request
+        self._waiting = {}  # update_id -> Future
+
+    async def start(self, application):
+        processor = application.update_processor
+        process = processor.do_process_update
+        waiting = self._waiting
+
+        async def do_process_update(update, coroutine):
+            try:
+                await process(update, coroutine)
+            finally:
+                future = waiting.pop(update.update_id, None)
+                if future is not None and not future.done():
+                    future.set_result(None)
+
+        processor.do_process_update = do_process_update
+
+    async def deliver(self, application, payload):
+        future = asyncio.get_running_loop().create_future()
+        self._waiting[payload["update_id"]] = future
+        await self.push(application, payload)
+        await future
+
+
+class PollingTransport(QueuedTransport):
+    """Updater.start_polling: бот сам забирает апдейты через getUpdates из FakeRequest"""
+
+    async def start(self, application):
+        await super().start(application)
+        await application.updater.start_polling(poll_interval=0, timeout=1)
+
+    async def stop(self, application):
+        await application.updater.stop()
+
+    async def push(self, application, payload):
+        self.request.push_update(payload)
+
+
+class HttpClient:
+    """Минимальный HTTP/1.1-клиент с keep-alive поверх asyncio.
+
+    httpx на сотнях одновременных запросов сам съедает больше процессора,
+    чем вебхук-сервер, и замер показывал бы клиента, а не бота.
+    """
+
+    def __init__(self, host, port, max_connections=100):
+        self.host = host
+        self.port = port
+        self._slots = asyncio.Semaphore(max_connections)
+        self._idle = []
+
+    async def post(self, path, body, headers):
+        async with self._slots:
+            if self._idle:
+                reader, writer = self._idle.pop()
+            else:
+                reader, writer = await asyncio.open_connection(self.host, self.port)
+            try:
+                head = [f"POST {path} HTTP/1.1", f"Host: {self.host}:{self.port}", f"Content-Length: {len(body)}"]
+                head += [f"{name}: {value}" for name, value in headers.items()]
+                writer.write(("\r\n".join(head) + "\r\n\r\n").encode() + body)
+                await writer.drain()
+                status = int((await reader.readline()).split()[1])
+                length, keep_alive = 0, True
+                while (line := await reader.readline()) not in (b"\r\n", b""):
+                    name, _, value = line.decode("latin-1").partition(":")
+                    name, value = name.strip().lower(), value.strip().lower()
+                    if name == "content-length":
+                        length = int(value)
+                    elif name == "connection" and value == "close":
+                        keep_alive = False
+                if length:
+                    await reader.readexactly(length)
+            except BaseException:
+                writer.close()
+                raise
+            if keep_alive:
+                self._idle.append((reader, writer))
+            else:
+                writer.close()
+            return status
+
+    async def close(self):
+        for _, writer in self._idle:
+            writer.close()
+        self._idle = []
+
+
+class WebhookTransport(QueuedTransport):
+    """Вебхук-сервер PTB на локальном порту: апдейты приходят POST-запросами с секретом"""
+
+    async def start(self, application):
+        await super().start(application)
+        with socket.socket() as sock:
+            sock.bind(("127.0.0.1", 0))
+            port = sock.getsockname()[1]
+        self.path = f"/{bot.WEBHOOK_PATH}"
+        await application.updater.start_webhook(
+            listen="127.0.0.1", port=port, url_path=bot.WEBHOOK_PATH,
+            webhook_url=f"http://127.0.0.1:{port}{self.path}",
+            secret_token=bot.WEBHOOK_SECRET, max_connections=min(100, bot.CONCURRENT_UPDATES),
+        )
+        self.client = HttpClient("127.0.0.1", port)
+        # Запрос без верного секрета сервер должен отклонить
+        status = await self.client.post(self.path, b'{"update_id": 0}', {
+            "Content-Type": "application/json", "X-Telegram-Bot-Api-Secret-Token": "wrong",
+        })
+        print(f"Запрос с неверным секретом: HTTP {status}")
+
+    async def stop(self, application):
+        await self.client.close()
+        await application.updater.stop()
+
+    async def push(self, application, payload):
+        status = await self.client.post(self.path, json.dumps(payload).encode(), {
+            "Content-Type": "application/json", "X-Telegram-Bot-Api-Secret-Token": bot.WEBHOOK_SECRET,
+        })
+        if status != 200:
+            raise RuntimeError(f"Вебхук ответил HTTP {status}")
+
+
+TRANSPORTS = {'direct': DirectTransport, 'polling': PollingTransport, 'webhook': WebhookTransport}
+
+
+class Recorder:
+    def __init__(self, transport=None):
+        self.transport = transport or DirectTransport()
+        self.latencies = {}
+
+    async def send(self, application, step, payload):
+        started = time.perf_counter()
+        await self.transport.deliver(application, payload)
+        self.latencies.setdefault(step, []).append(time.perf_counter() - started)
+
+    @property
+    def total(self):
+        return sum(len(v) for v in self.latencies.values())
+
+    def percentile(self, p, step=None):
+        """Перцентиль задержки в мс по шагу или по всем апдейтам"""
+        if step is None:
+            values = sorted(itertools.chain.from_iterable(self.latencies.values()))
+        else:
+            values = sorted(self.latencies.get(step, ()))
+        if not values:
+            return 0.0
+        return values[min(len(values) - 1, int(len(values) * p / 100))] * 1000
+
+    def report(self, elapsed):
+        print(f"Апдейтов: {self.total} за {elapsed:.2f} с ({self.total / elapsed:.0f}/с)")
+        print(f"{'шаг':<14}{'кол-во':>8}{'p50, мс':>10}{'p95, мс':>10}{'p99, мс':>10}{'max, мс':>10}")
+        for step, values in self.latencies.items():
+            print(f"{step:<14}{len(values):>8}{self.percentile(50, step):>10.1f}{self.percentile(95, step):>10.1f}"
+                  f"{self.percentile(99, step):>10.1f}{max(values) * 1000:>10.1f}")
+
+
+REGISTRATION_STEPS = (
+    ("start", lambda i: "/start"),
+    ("nickname", lambda i: f"player{i}"),
+    ("rank", lambda i: str(5000 + i % 20000)),
+    ("name", lambda i: f"Игрок {i}"),
+    ("contact", lambda i: f"@player{i}"),
+    ("team", lambda i: "Нет" if i % 3 else f"Team {i % 50}"),
+)
+
+async def registrant(application, recorder, user_id):
+    for step, text in REGISTRATION_STEPS:
+        await recorder.send(application, step, message_update(user_id, text(user_id)))
+
+async def admin(application, recorder, admin_id, stop):
+    while not stop.is_set():
+        await recorder.send(application, "stats", callback_update(admin_id, "stats"))
+        await recorder.send(application, "list_all", callback_update(admin_id, "list_all"))
+
+
+async def slow_admin(application, recorder, admin_id, stop):
+    """Админ, который всё время держит в работе медленный запрос - выгрузку"""
+    while not stop.is_set():
+        await recorder.send(application, "export", message_update(admin_id, "/export"))
+
+
+def use_real_database():
+    return bool(os.environ.get('DATABASE_URL')) and bot.DATABASE_AVAILABLE
+
+
+async def startup(args):
+    """Замер запуска: сборка приложения, инициализация PTB и post_init"""
+    if not use_real_database():
+        install_memory_store(MemoryStore(args.db_latency / 1000))
+    phases = {"сборка": [], "initialize": [], "post_init": [], "всего": []}
+    for _ in range(args.startup):
+        started = time.perf_counter()
+        bot.initialize_database()
+        application = bot.build_application(request=FakeRequest(args.api_latency / 1000))
+        built = time.perf_counter()
+        await application.initialize()
+        initialized = time.perf_counter()
+        # post_init дожидается миграций, если они ещё идут
+        await bot.post_init(application)
+        ready = time.perf_counter()
+        await bot.post_stop(application)
+        await application.shutdown()
+        for phase, value in zip(phases, (built - started, initialized - built, ready - initialized, ready - started)):
+            phases[phase].append(value)
+
+    print(f"Запусков: {args.startup}")
+    print(f"{'этап':<14}{'p50, мс':>10}{'max, мс':>10}")
+    for phase, values in phases.items():
+        values = sorted(values)
+        print(f"{phase:<14}{values[len(values) // 2] * 1000:>10.1f}{values[-1] * 1000:>10.1f}")
+
+
+# Каждая кнопка нажимается дважды: второе нажатие приходит под уже показанным экраном
+CALLBACK_SEQUENCE = ("stats", "stats", "back_to_admin_menu", "back_to_admin_menu",
+                     "list_all", "list_all", "back_to_admin_menu", "back_to_admin_menu")
+
+async def callbacks(args):
+    """Замер обработки нажатий в админ-панели и числа правок сообщений"""
+    store = MemoryStore()
+    for i in range(1, args.users + 1):
+        store.save_application(f"player{i}", str(5000 + i), f"Игрок {i}", f"@player{i}",
+                               "Нет" if i % 3 else f"Team {i % 50}")
+    store.latency = args.db_latency / 1000
+    install_memory_store(store)
+
+    request = FakeRequest(args.api_latency / 1000)
+    application = bot.build_application(request=request)
+    await application.initialize()
+    # JobQueue нужен для таймаута незавершённых регистраций
+    await application.start()
+    admin_id = ADMIN_IDS[0]
+    # Экран, с которого админ начинает: /start
+    await application.process_update(Update.de_json(message_update(admin_id, "/start"), application.bot))
+
+    calls_before, edits_before = request.calls, request.edits
+    presses = 0
+    started = time.perf_counter()
+    for _ in range(args.callbacks):
+        for data in CALLBACK_SEQUENCE:
+            payload = callback_update(admin_id, data, request.screens[admin_id])
+            await application.process_update(Update.de_json(payload, application.bot))
+            presses += 1
+    elapsed = time.perf_counter() - started
+    await application.stop()
+    await application.shutdown()
+
+    edits = request.edits - edits_before
+    print(f"Нажатий: {presses}, {elapsed / presses * 1e6:.0f} мкс на нажатие")
+    print(f"Запросов к Bot API: {request.calls - calls_before} (answerCallbackQuery на каждое нажатие)")
+    print(f"Правок сообщения: {edits}, пропущено без изменений: {presses - edits}")
+
+
+def install_unpooled_connections():
+    """Соединение на каждый вызов БД, как до пула: пул database.py, закрывающий соединения после вызова"""
+    import database
+
+    class UnpooledConnections(database.ConnectionPool):
+        def _release(self, conn):
+            conn.close()
+
+    database.close_pool()
+    database._pool = UnpooledConnections(0, database.DB_POOL_MAX, database.DB_POOL_TIMEOUT,
+                                         database.DB_HEALTHCHECK_INTERVAL)
+
+
+async def run(args, concurrent_updates=None, slow_query=0.0, pooled=True, write_behind_enabled=None,
+              transport=None):
+    """Один прогон нагрузки. Печатает отчёт и возвращает сводку для сравнения.
+
+    transport - как апдейты доходят до бота: direct, polling или webhook
+    (None - как в --transport).
+
+    slow_query - если больше нуля, последний админ всё время выгружает
+    анкеты, и каждая выгрузка занимает поток БД столько секунд.
+    pooled=False - вместо пула соединение на каждый вызов (только с DATABASE_URL).
+    write_behind_enabled - пакетная запись анкет; None - как в WRITE_BEHIND.
+    """
+    if concurrent_updates is not None:
+        bot.CONCURRENT_UPDATES = concurrent_updates
+    # Каждый прогон - как новый процесс: без заявок, запомненных прошлым прогоном
+    bot.recent_submissions.clear()
+    bot.search_index.clear()
+    pool = None
+    if use_real_database():
+        if not pooled:
+            install_unpooled_connections()
+        bot.initialize_database()
+        from database import get_pool
+        # Пул закрывается при остановке бота, поэтому счётчик берём у этого объекта
+        pool = get_pool()
+    else:
+        install_memory_store(MemoryStore(args.db_latency / 1000, slow_query))
+    if write_behind_enabled is not None:
+        bot.WRITE_BEHIND_ENABLED = write_behind_enabled
+
+    request = FakeRequest(args.api_latency / 1000)
+    application = bot.build_application(request=request)
+    await application.initialize()
+    # JobQueue нужен для таймаута незавершённых регистраций
+    await application.start()
+    await bot.post_init(application)
+    transport = TRANSPORTS[transport or args.transport](request)
+    await transport.start(application)
+    # Соединения, открытые миграциями и заполнением пула, в замер не входят
+    opened_before = pool.opened if pool is not None else 0
+
+    recorder = Recorder(transport)
+    stop = asyncio.Event()
+    admins = [asyncio.create_task(admin(application, recorder, admin_id, stop))
+              for admin_id in ADMIN_IDS[:args.admins]]
+    # Выгрузки считаются отдельно: в общих перцентилях нужны обычные обработчики
+    slow_recorder = Recorder(transport)
+    if slow_query:
+        admins.append(asyncio.create_task(slow_admin(application, slow_recorder, ADMIN_IDS[-1], stop)))
+
+    started = time.perf_counter()
+    # Пользователи приходят волнами по --concurrency одновременно
+    user_ids = range(1, args.users + 1)
+    for i in range(0, args.users, args.concurrency):
+        await asyncio.gather(*(registrant(application, recorder, uid) for uid in user_ids[i:i + args.concurrency]))
+    # Время - до конца регистраций: ожидание начатой выгрузки в него не входит
+    elapsed = time.perf_counter() - started
+    stop.set()
+    await asyncio.gather(*admins)
+
+    await transport.stop(application)
+    await application.stop()
+    await bot.post_stop(application)
+    await application.shutdown()
+
+    recorder.report(elapsed)
+    if slow_recorder.total:
+        print(f"Выгрузок: {slow_recorder.total}, p50 {slow_recorder.percentile(50):.0f} мс")
+    print(f"Запросов к Bot API: {request.calls}")
+    opened = None
+    if pool is not None:
+        opened = pool.opened - opened_before
+        print(f"Открыто соединений с БД: {opened} ({opened / elapsed:.1f}/с, "
+              f"{opened / recorder.total:.3f} на апдейт)")
+    else:
+        print("Открыто соединений с БД: - (хранилище в памяти)")
+    return {
+        "апдейтов/с": recorder.total / elapsed,
+        "p99, мс": recorder.percentile(99),
+        "анкет/с": len(recorder.latencies.get("team", ())) / elapsed,
+        "p99 team, мс": recorder.percentile(99, "team"),
+        "Bot API": request.calls,
+        "соединений БД": "-" if opened is None else opened,
+        "соединений/с": "-" if opened is None else opened / elapsed,
+    }
+
+
+# Варианты для --compare: (название прогона, настройки для run)
+COMPARISONS = {
+    # Обработка апдейтов строго по одному и по 32 одновременно
+    'concurrency': (
+        ("по одному", {"concurrent_updates": 1}),
+        ("по 32", {"concurrent_updates": 32}),
+    ),
+    # Через Updater: polling (getUpdates) и вебхук-сервер PTB с POST-запросами
+    'webhook': (
+        ("polling", {"transport": "polling"}),
+        ("вебхук", {"transport": "webhook"}),
+    ),
+    # Задержки обработчиков без медленного запроса и пока он идёт (--slow-query секунд)
+    'slow-query': (
+        ("без выгрузки", {}),
+        ("с выгрузкой", {"slow_query": None}),
+    ),
+    # Пакетная запись анкет против INSERT на каждую анкету
+    'write-behind': (
+        ("по одной", {"write_behind_enabled": False}),
+        ("пачками", {"write_behind_enabled": True}),
+    ),
+    # Пул соединений против соединения на каждый вызов; нужен DATABASE_URL
+    'pool': (
+        ("пул", {}),
+        ("без пула", {"pooled": False}),
+    ),
+}
+
+async def compare(args):
+    """Прогоны нагрузки с разными настройками и общая таблица по ним"""
+    if args.compare == 'pool' and not use_real_database():
+        print("Для --compare pool нужен Postgres: задайте DATABASE_URL")
+        return 1
+    results = []
+    for label, settings in COMPARISONS[args.compare]:
+        print(f"=== {label} ===")
+        # None - значение берётся из одноимённого параметра командной строки
+        settings = {name: getattr(args, name) if value is None else value for name, value in settings.items()}
+        results.append((label, await run(args, **settings)))
+        print()
+    columns = list(results[0][1])
+    print(f"{'прогон':<18}" + "".join(f"{column:>16}" for column in columns))
+    for label, summary in results:
+        cells = (f"{value:>16.1f}" if isinstance(value, float) else f"{value:>16}" for value in summary.values())
+        print(f"{label:<18}" + "".join(cells))
+
+
+def fake_applications(count):
+    """Строки выгрузки, как их отдаёт iter_applications, без хранения в памяти"""
+    started = datetime(2024, 1, 1)
+    for i in range(1, count + 1):
+        yield {
+            'id': i, 'nickname': f"player{i}", 'rank': str(5000 + i % 20000), 'name': f"Игрок {i}",
+            'contact': f"@player{i}", 'team': "Нет" if i % 3 else f"Team {i % 50}",
+            'created_at': started + timedelta(seconds=i),
+        }
+
+
+def install_export_source(count):
+    """Подмена чтения анкет в export.py генератором на count строк"""
+    def copy_applications_csv(fileobj):
+        # Как COPY TO STDOUT: строки пишутся в файл порциями по мере генерации
+        text = io.TextIOWrapper(fileobj, encoding="utf-8", newline="")
+        writer = csv.writer(text)
+        writer.writerow(export.EXPORT_COLUMNS)
+        for row in fake_applications(count):
+            writer.writerow([row[column] for column in export.EXPORT_COLUMNS])
+        # Файл закрывает вызывающий код, обёртку только отсоединяем
+        text.flush()
+        text.detach()
+
+    export.copy_applications_csv = copy_applications_csv
+    export.iter_applications = lambda: fake_applications(count)
+
+
+def peak_rss_mb():
+    # ru_maxrss в Linux - в килобайтах
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def export_benchmark(args):
+    """Замер выгрузки: время, размер файла и рост пиковой памяти процесса"""
+    if use_real_database():
+        bot.initialize_database()
+        rows = "текущий турнир"
+    else:
+        install_export_source(args.export)
+        rows = args.export
+    rss_before = peak_rss_mb()
+    started = time.perf_counter()
+    try:
+        path, filename = export.export_applications(args.export_format)
+    except RuntimeError as e:
+        print(f"Выгрузка не удалась: {e}")
+        return 1
+    elapsed = time.perf_counter() - started
+    size = os.path.getsize(path)
+    os.remove(path)
+    rss_after = peak_rss_mb()
+    print(f"Анкет: {rows}, формат: {args.export_format}, файл: {filename}")
+    print(f"Время: {elapsed:.1f} с, размер: {size / 1024 / 1024:.1f} МБ")
+    print(f"Пиковая память: {rss_before:.0f} МБ до выгрузки, {rss_after:.0f} МБ после "
+          f"(+{rss_after - rss_before:.0f} МБ)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Нагрузочный тест регистрации")
+    parser.add_argument("--users", type=int, default=200, help="сколько пользователей регистрируется")
+    parser.add_argument("--concurrency", type=int, default=100, help="сколько из них одновременно")
+    parser.add_argument("--admins", type=int, default=2, help=f"админов, жмущих кнопки (до {len(ADMIN_IDS)})")
+    parser.add_argument("--api-latency", type=float, default=20, help="задержка Bot API, мс")
+    parser.add_argument("--db-latency", type=float, default=2, help="задержка хранилища в памяти, мс")
+    parser.add_argument("--startup", type=int, default=0, help="вместо нагрузки замерить N запусков бота")
+    parser.add_argument("--callbacks", type=int, default=0,
+                        help="вместо нагрузки N раз пройти по экранам админ-панели")
+    parser.add_argument("--export", type=int, default=0, help="вместо нагрузки замерить выгрузку N анкет")
+    parser.add_argument("--export-format", choices=("csv", "xlsx"), default="csv")
+    parser.add_argument("--compare", choices=COMPARISONS,
+                        help="прогнать нагрузку в нескольких вариантах и сравнить их")
+    parser.add_argument("--transport", choices=TRANSPORTS, default="direct",
+                        help="как апдейты доходят до бота: напрямую, через getUpdates или POST на вебхук")
+    parser.add_argument("--slow-query", type=float, default=3, help="длительность выгрузки для --compare slow-query, с")
+    args = parser.parse_args()
+    if args.export:
+        return export_benchmark(args)
+    if args.startup:
+        asyncio.run(startup(args))
+    elif args.callbacks:
+        asyncio.run(callbacks(args))
+    elif args.compare:
+        return asyncio.run(compare(args))
+    else:
+        asyncio.run(run(args))
+
+if __name__ == '__main__':
+    sys.exit(main())
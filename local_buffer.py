@@ -0,0 +1,180 @@
+# local_buffer.py
+import os
+import time
+import sqlite3
+import asyncio
+import logging
+import threading
+from datetime import datetime, timezone
+
+logger = logging.getLogger(__name__)
+
+# Анкеты, которые не удалось записать в Postgres, ждут здесь
+LOCAL_BUFFER_PATH = os.environ.get('LOCAL_BUFFER_PATH', 'pending_applications.sqlite3')
+# Как часто (в секундах) пробовать дописать их в БД и сколько строк за раз
+BUFFER_REPLAY_INTERVAL = float(os.environ.get('BUFFER_REPLAY_INTERVAL', '5'))
+BUFFER_REPLAY_BATCH = int(os.environ.get('BUFFER_REPLAY_BATCH', '100'))
+
+
+class LocalBuffer:
+    """Локальный журнал анкет в SQLite (режим WAL), только добавление и удаление"""
+
+    def __init__(self, path=LOCAL_BUFFER_PATH):
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        # FULL: анкета должна пережить падение процесса и питания сразу после ответа пользователю
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=FULL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS pending_applications (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                nickname TEXT NOT NULL,
+                rank TEXT NOT NULL,
+                name TEXT,
+                contact TEXT NOT NULL,
+                team TEXT,
+                user_id INTEGER,
+                created_at REAL NOT NULL
+            )
+        """)
+        # Буфер мог остаться от версии без user_id
+        columns = [row[1] for row in self._conn.execute("PRAGMA table_info(pending_applications)")]
+        if 'user_id' not in columns:
+            self._conn.execute("ALTER TABLE pending_applications ADD COLUMN user_id INTEGER")
+        # Анкеты, которые БД отвергла (ошибка в данных): лежат здесь, пока их не разберут вручную
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS rejected_applications (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                nickname TEXT,
+                rank TEXT,
+                name TEXT,
+                contact TEXT,
+                team TEXT,
+                user_id INTEGER,
+                created_at REAL NOT NULL,
+                error TEXT NOT NULL
+            )
+        """)
+        self._lock = threading.Lock()
+
+    def add(self, nickname, rank, name, contact, team, user_id=None):
+        with self._lock:
+            cur = self._conn.execute("""
+                INSERT INTO pending_applications (nickname, rank, name, contact, team, user_id, created_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            """, (nickname, rank, name, contact, team, user_id, time.time()))
+            return cur.lastrowid
+
+    def pending(self, limit):
+        """Самые старые анкеты: список пар (локальный ID, строка для save_applications_batch)"""
+        with self._lock:
+            rows = self._conn.execute("""
+                SELECT id, nickname, rank, name, contact, team, user_id, created_at
+                FROM pending_applications ORDER BY id LIMIT ?
+            """, (limit,)).fetchall()
+        # Время подачи сохраняется, иначе анкета встанет в списке на место времени записи
+        return [(row[0], tuple(row[1:7]) + (datetime.fromtimestamp(row[7], timezone.utc),)) for row in rows]
+
+    def done(self, local_ids):
+        with self._lock:
+            self._conn.executemany("DELETE FROM pending_applications WHERE id = ?", [(i,) for i in local_ids])
+
+    def reject(self, local_id, error):
+        """Перенос анкеты в rejected_applications, чтобы она не задерживала остальные"""
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                self._conn.execute("""
+                    INSERT INTO rejected_applications (nickname, rank, name, contact, team, user_id, created_at, error)
+                    SELECT nickname, rank, name, contact, team, user_id, created_at, ?
+                    FROM pending_applications WHERE id = ?
+                """, (error, local_id))
+                self._conn.execute("DELETE FROM pending_applications WHERE id = ?", (local_id,))
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def count(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM pending_applications").fetchone()[0]
+
+    def rejected_count(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM rejected_applications").fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class BufferReplayer:
+    """Фоновая задача: переносит анкеты из локального буфера в БД пачками.
+
+    save_batch - корутина, которая сохраняет список строк и возвращает для
+    каждой ID или исключение, если БД эту строку не принимает; такие строки
+    откладываются в rejected_applications. Ошибка самой save_batch оставляет
+    пачку в буфере до следующей попытки.
+    on_synced(rows, app_ids) вызывается после каждой записанной пачки.
+    """
+
+    def __init__(self, buffer, save_batch, on_synced=None,
+                 interval=BUFFER_REPLAY_INTERVAL, batch_size=BUFFER_REPLAY_BATCH):
+        self.buffer = buffer
+        self.save_batch = save_batch
+        self.on_synced = on_synced
+        self.interval = interval
+        self.batch_size = batch_size
+        self._task = None
+        self._failing = False
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        await asyncio.to_thread(self.buffer.close)
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.replay()
+                self._failing = False
+            except Exception as e:
+                # Во время простоя БД пишем в лог только первую неудачу
+                if not self._failing:
+                    logger.warning(f"Анкеты из локального буфера пока не записаны: {e}")
+                self._failing = True
+
+    async def replay(self):
+        """Запись всех анкет из буфера; при ошибке оставшиеся ждут следующей попытки"""
+        synced = 0
+        while True:
+            pending = await asyncio.to_thread(self.buffer.pending, self.batch_size)
+            if not pending:
+                break
+            # Повторная запись безопасна: save_applications_batch обновляет существующую анкету
+            results = await self.save_batch([row for _, row in pending])
+            local_ids, rows, app_ids = [], [], []
+            for (local_id, row), result in zip(pending, results):
+                if isinstance(result, Exception):
+                    logger.error(f"Анкета из локального буфера отклонена БД и отложена ({row[0]}, {row[3]}): {result}")
+                    await asyncio.to_thread(self.buffer.reject, local_id, str(result))
+                else:
+                    local_ids.append(local_id)
+                    rows.append(row)
+                    app_ids.append(result)
+            await asyncio.to_thread(self.buffer.done, local_ids)
+            synced += len(rows)
+            if self.on_synced and rows:
+                self.on_synced(rows, app_ids)
+        if synced:
+            logger.info(f"✅ Из локального буфера в БД записано анкет: {synced}")
+        return synced
@@ -0,0 +1,273 @@
+# metrics.py
+import io
+import os
+import sys
+import time
+import asyncio
+import logging
+import functools
+import threading
+import traceback
+
+from telegram.request import HTTPXRequest
+
+logger = logging.getLogger(__name__)
+
+# Эндпоинт /metrics (0 - выключен)
+METRICS_HOST = os.environ.get('METRICS_HOST', '127.0.0.1')
+METRICS_PORT = int(os.environ.get('METRICS_PORT', '9090'))
+# Обработчик дольше этого попадает в лог медленных вместе со стеком
+SLOW_HANDLER_SECONDS = float(os.environ.get('SLOW_HANDLER_SECONDS', '1.0'))
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _format_labels(names, values, extra=None):
+    pairs = list(zip(names, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"') for _, v in pairs)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + "}"
+
+
+class Counter:
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help = help_text
+        self.labels = labels
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for values, count in self._values.items():
+                lines.append(f"{self.name}{_format_labels(self.labels, values)} {count}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help_text, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labels = labels
+        self.buckets = buckets
+        self._series = {}  # значения меток -> [счётчики по корзинам, сумма, количество]
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][i] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for values, (counts, total, count) in self._series.items():
+                for bound, bucket_count in zip(self.buckets, counts):
+                    labels = _format_labels(self.labels, values, ("le", bound))
+                    lines.append(f"{self.name}_bucket{labels} {bucket_count}")
+                labels = _format_labels(self.labels, values, ("le", "+Inf"))
+                lines.append(f"{self.name}_bucket{labels} {count}")
+                labels = _format_labels(self.labels, values)
+                lines.append(f"{self.name}_sum{labels} {total}")
+                lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+class Gauge:
+    """Значение, которое считается в момент запроса /metrics"""
+
+    def __init__(self, name, help_text, func):
+        self.name = name
+        self.help = help_text
+        self.func = func
+
+    def render(self):
+        try:
+            value = self.func()
+        except Exception:
+            return []
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge", f"{self.name} {value}"]
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+
+    def _add(self, metric):
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, help_text, labels=()):
+        return self._add(Counter(name, help_text, labels))
+
+    def histogram(self, name, help_text, labels=(), buckets=DEFAULT_BUCKETS):
+        return self._add(Histogram(name, help_text, labels, buckets))
+
+    def gauge(self, name, help_text, func):
+        return self._add(Gauge(name, help_text, func))
+
+    def render(self):
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+HANDLER_SECONDS = REGISTRY.histogram('bot_handler_seconds', 'Время работы обработчика', ('handler',))
+HANDLER_ERRORS = REGISTRY.counter('bot_handler_errors_total', 'Исключения в обработчиках', ('handler',))
+DB_CALL_SECONDS = REGISTRY.histogram('bot_db_call_seconds', 'Время вызова database.py', ('func',))
+DB_CALL_ERRORS = REGISTRY.counter('bot_db_call_errors_total', 'Ошибки вызовов database.py', ('func',))
+DB_CONNECTIONS_OPENED = REGISTRY.counter('bot_db_connections_opened_total', 'Открыто соединений с БД за всё время')
+TELEGRAM_API_SECONDS = REGISTRY.histogram('bot_telegram_api_seconds', 'Время запроса к Bot API', ('method',))
+TELEGRAM_API_ERRORS = REGISTRY.counter('bot_telegram_api_errors_total', 'Ошибки запросов к Bot API', ('method',))
+
+
+# === Лог медленных обработчиков ===
+class SlowHandlerWatchdog(threading.Thread):
+    """Фоновый поток, который снимает стек, если обработчик работает дольше порога.
+
+    Снимается и стек потока цикла событий (видно, чем он занят, если его
+    заблокировал синхронный код), и стек корутины самого обработчика.
+    """
+
+    def __init__(self, threshold=SLOW_HANDLER_SECONDS, interval=0.1):
+        super().__init__(name="slow-handler-watchdog", daemon=True)
+        self.threshold = threshold
+        self.interval = interval
+        self._running = {}  # токен -> (имя, время старта, задача, ID потока)
+        self._reported = set()
+        self._lock = threading.Lock()
+        self._next_token = 0
+
+    def enter(self, name):
+        with self._lock:
+            self._next_token += 1
+            token = self._next_token
+            self._running[token] = (name, time.monotonic(), asyncio.current_task(), threading.get_ident())
+        return token
+
+    def exit(self, token):
+        with self._lock:
+            self._running.pop(token, None)
+            self._reported.discard(token)
+
+    def run(self):
+        while True:
+            time.sleep(self.interval)
+            now = time.monotonic()
+            with self._lock:
+                slow = [
+                    (token, entry) for token, entry in self._running.items()
+                    if token not in self._reported and now - entry[1] > self.threshold
+                ]
+                self._reported.update(token for token, _ in slow)
+            for _, (name, started, task, thread_id) in slow:
+                self._report(name, now - started, task, thread_id)
+
+    def _report(self, name, elapsed, task, thread_id):
+        frame = sys._current_frames().get(thread_id)
+        loop_stack = "".join(traceback.format_stack(frame)) if frame else "-"
+        task_stack = "-"
+        if task is not None:
+            buffer = io.StringIO()
+            try:
+                task.print_stack(file=buffer)
+                task_stack = buffer.getvalue()
+            except Exception:
+                pass
+        logger.warning(
+            f"🐢 Обработчик {name} работает уже {elapsed:.2f} с\n"
+            f"Стек цикла событий:\n{loop_stack}\nСтек обработчика:\n{task_stack}"
+        )
+
+
+watchdog = SlowHandlerWatchdog()
+
+def timed_handler(name):
+    """Декоратор: гистограмма времени, счётчик ошибок и лог медленных вызовов"""
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            token = watchdog.enter(name)
+            started = time.monotonic()
+            try:
+                return await func(*args, **kwargs)
+            except Exception:
+                HANDLER_ERRORS.inc(name)
+                raise
+            finally:
+                HANDLER_SECONDS.observe(time.monotonic() - started, name)
+                watchdog.exit(token)
+        return wrapper
+    return decorator
+
+
+# === HTTP-эндпоинт ===
+async def _handle_metrics_request(reader, writer):
+    try:
+        request_line = await reader.readline()
+        # Заголовки запроса не нужны, но их надо дочитать
+        while (await reader.readline()).strip():
+            pass
+        parts = request_line.decode("latin-1").split()
+        if len(parts) >= 2 and parts[0] == "GET" and parts[1].split("?")[0] == "/metrics":
+            body = REGISTRY.render().encode()
+            status = "200 OK"
+        else:
+            body = b"not found\n"
+            status = "404 Not Found"
+        writer.write(
+            f"HTTP/1.1 {status}\r\nContent-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+            f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body
+        )
+        await writer.drain()
+    except (ConnectionError, asyncio.IncompleteReadError):
+        pass
+    finally:
+        writer.close()
+
+async def start_metrics_server(host=METRICS_HOST, port=METRICS_PORT):
+    """Запуск /metrics и потока лога медленных обработчиков"""
+    if not watchdog.is_alive():
+        watchdog.start()
+    if not port:
+        return None
+    server = await asyncio.start_server(_handle_metrics_request, host, port)
+    logger.info(f"📈 Метрики на http://{host}:{port}/metrics")
+    return server
+
+
+# === Запросы к Bot API ===
+class InstrumentedRequest(HTTPXRequest):
+    """HTTPXRequest, который замеряет время и ошибки каждого метода Bot API"""
+
+    async def do_request(self, url, method, *args, **kwargs):
+        # Последний сегмент URL - имя метода (sendMessage и т.п.), токен в метки не попадает
+        api_method = url.rsplit("/", 1)[-1]
+        started = time.monotonic()
+        try:
+            code, payload = await super().do_request(url, method, *args, **kwargs)
+        except Exception:
+            TELEGRAM_API_ERRORS.inc(api_method)
+            raise
+        finally:
+            TELEGRAM_API_SECONDS.observe(time.monotonic() - started, api_method)
+        if code >= 400:
+            TELEGRAM_API_ERRORS.inc(api_method)
+        return code, payload
@@ -0,0 +1,195 @@
+# migrations.py
+"""Версионные миграции схемы Postgres.
+
+Применённые версии записываются в schema_migrations, поэтому при
+актуальной схеме запуск стоит пару коротких запросов. Миграции не
+меняются задним числом - изменения схемы добавляются новой версией.
+Первые версии написаны через IF NOT EXISTS: базы, созданные до
+появления миграций, принимают их без ошибок.
+"""
+import os
+import logging
+
+import psycopg2
+
+logger = logging.getLogger(__name__)
+
+# Ключ advisory-блокировки: миграции применяет одна реплика, остальные ждут
+MIGRATION_LOCK_KEY = int(os.environ.get('MIGRATION_LOCK_KEY', '7245602'))
+
+# Текст для поиска /find; database.py ищет по этому же выражению, иначе индекс не используется
+SEARCH_DOCUMENT = "lower(nickname || ' ' || coalesce(name, '') || ' ' || contact || ' ' || coalesce(team, ''))"
+
+
+class Migration:
+    """Версия схемы. optional - ошибка не останавливает запуск, миграция повторится при следующем"""
+
+    def __init__(self, version, description, statements, optional=False):
+        self.version = version
+        self.description = description
+        self.statements = statements
+        self.optional = optional
+
+
+MIGRATIONS = [
+    Migration(1, "таблица анкет", [
+        """
+        CREATE TABLE IF NOT EXISTS applications (
+            id SERIAL PRIMARY KEY,
+            nickname VARCHAR(100) NOT NULL,
+            rank VARCHAR(100) NOT NULL,
+            name VARCHAR(100),
+            contact VARCHAR(200) NOT NULL,
+            team VARCHAR(100),
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        """,
+    ]),
+    Migration(2, "ключ повторной заявки", [
+        # У старых записей ключ пустой и в проверке не участвует
+        "ALTER TABLE applications ADD COLUMN IF NOT EXISTS dedup_key TEXT",
+    ]),
+    Migration(3, "турниры", [
+        # Открыт всегда ровно один турнир, закрытые остаются архивом
+        """
+        CREATE TABLE IF NOT EXISTS tournaments (
+            id SERIAL PRIMARY KEY,
+            title VARCHAR(100),
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            closed_at TIMESTAMP
+        )
+        """,
+        """
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_tournaments_active
+        ON tournaments ((closed_at IS NULL)) WHERE closed_at IS NULL
+        """,
+        """
+        INSERT INTO tournaments (title)
+        SELECT NULL WHERE NOT EXISTS (SELECT 1 FROM tournaments WHERE closed_at IS NULL)
+        """,
+        # Заявки, созданные до появления турниров, относятся к текущему
+        "ALTER TABLE applications ADD COLUMN IF NOT EXISTS tournament_id INTEGER REFERENCES tournaments (id)",
+        """
+        UPDATE applications SET tournament_id = (SELECT id FROM tournaments WHERE closed_at IS NULL)
+        WHERE tournament_id IS NULL
+        """,
+        # Все запросы идут в пределах турнира, поэтому индексы начинаются с tournament_id
+        "DROP INDEX IF EXISTS idx_applications_created_id",
+        "DROP INDEX IF EXISTS idx_applications_dedup_key",
+        """
+        CREATE INDEX IF NOT EXISTS idx_applications_tournament_created
+        ON applications (tournament_id, created_at DESC, id DESC)
+        """,
+        """
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_applications_tournament_dedup
+        ON applications (tournament_id, dedup_key)
+        """,
+    ]),
+    Migration(4, "рассылки", [
+        # Чат пользователя в Telegram; получатели перебираются по user_id прямо по индексу
+        "ALTER TABLE applications ADD COLUMN IF NOT EXISTS user_id BIGINT",
+        """
+        CREATE INDEX IF NOT EXISTS idx_applications_tournament_user
+        ON applications (tournament_id, user_id)
+        """,
+        # last_user_id - докуда дошли, чтобы продолжить после перезапуска
+        """
+        CREATE TABLE IF NOT EXISTS broadcasts (
+            id SERIAL PRIMARY KEY,
+            tournament_id INTEGER NOT NULL REFERENCES tournaments (id),
+            text TEXT NOT NULL,
+            admin_chat_id BIGINT NOT NULL,
+            progress_message_id BIGINT,
+            status VARCHAR(16) NOT NULL DEFAULT 'running',
+            last_user_id BIGINT NOT NULL DEFAULT 0,
+            sent INTEGER NOT NULL DEFAULT 0,
+            failed INTEGER NOT NULL DEFAULT 0,
+            locked_until TIMESTAMP,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            finished_at TIMESTAMP
+        )
+        """,
+    ]),
+    # Без прав на CREATE EXTENSION поиск работает по подстроке
+    Migration(5, "триграммный индекс поиска", [
+        "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+        f"""
+        CREATE INDEX IF NOT EXISTS idx_applications_search_trgm
+        ON applications USING gin (({SEARCH_DOCUMENT}) gin_trgm_ops)
+        """,
+    ], optional=True),
+    # Незавершённые регистрации для persistence.py (PERSISTENCE_BACKEND=postgres)
+    Migration(6, "состояние диалогов", [
+        """
+        CREATE TABLE IF NOT EXISTS bot_conversations (
+            name VARCHAR(64) NOT NULL,
+            key VARCHAR(64) NOT NULL,
+            state INTEGER NOT NULL,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (name, key)
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS bot_user_drafts (
+            user_id BIGINT PRIMARY KEY,
+            data TEXT NOT NULL,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        """,
+    ]),
+    # Когда подана версия анкеты, лежащая в записи: запоздалая запись из локального
+    # буфера не должна затирать более новую. У старых записей берётся created_at
+    Migration(7, "время подачи анкеты", [
+        "ALTER TABLE applications ADD COLUMN IF NOT EXISTS submitted_at TIMESTAMP",
+    ]),
+]
+SEARCH_MIGRATION = 5
+
+
+def _applied_versions(cur):
+    cur.execute("SELECT to_regclass('schema_migrations') IS NOT NULL AS present")
+    if not cur.fetchone()['present']:
+        return set()
+    cur.execute("SELECT version FROM schema_migrations")
+    return {row['version'] for row in cur.fetchall()}
+
+
+def migrate(cur):
+    """Применение недостающих миграций в транзакции курсора. Возвращает применённые версии"""
+    applied = _applied_versions(cur)
+    if all(m.version in applied for m in MIGRATIONS):
+        return applied
+
+    # Соединения пула ограничены statement_timeout: без этого ждущая блокировку реплика
+    # и долгие UPDATE/CREATE INDEX на большой таблице были бы отменены
+    cur.execute("SET LOCAL statement_timeout = 0")
+    cur.execute("SELECT pg_advisory_xact_lock(%s)", (MIGRATION_LOCK_KEY,))
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version INTEGER PRIMARY KEY,
+            description TEXT NOT NULL,
+            applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    # Пока ждали блокировку, другая реплика могла всё применить
+    applied = _applied_versions(cur)
+    for migration in MIGRATIONS:
+        if migration.version in applied:
+            continue
+        cur.execute("SAVEPOINT migration")
+        try:
+            for statement in migration.statements:
+                cur.execute(statement)
+        except psycopg2.Error as e:
+            if not migration.optional:
+                raise
+            cur.execute("ROLLBACK TO SAVEPOINT migration")
+            logger.warning(f"Миграция {migration.version} ({migration.description}) пропущена: {e}")
+            continue
+        cur.execute(
+            "INSERT INTO schema_migrations (version, description) VALUES (%s, %s)",
+            (migration.version, migration.description),
+        )
+        applied.add(migration.version)
+        logger.info(f"Применена миграция {migration.version}: {migration.description}")
+    return applied
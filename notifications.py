@@ -0,0 +1,208 @@
+# notifications.py
+import os
+import time
+import asyncio
+import logging
+from collections import deque
+
+from telegram.error import RetryAfter, TimedOut, NetworkError, Forbidden, BadRequest
+
+logger = logging.getLogger(__name__)
+
+# Лимиты Telegram: ~30 сообщений в секунду на бота и ~1 в секунду в один чат
+GLOBAL_RATE = float(os.environ.get('TELEGRAM_GLOBAL_RATE', '30'))
+PER_CHAT_RATE = float(os.environ.get('TELEGRAM_PER_CHAT_RATE', '1'))
+# Сколько раз повторять отправку при 429 и сетевых ошибках
+SEND_RETRIES = int(os.environ.get('TELEGRAM_SEND_RETRIES', '5'))
+# Если в очереди накопилось столько заявок, админам уходит одна сводка
+NOTIFY_DIGEST_THRESHOLD = int(os.environ.get('NOTIFY_DIGEST_THRESHOLD', '5'))
+
+MAX_MESSAGE_LENGTH = 4096
+
+
+class TokenBucket:
+    """Ограничитель частоты: rate токенов в секунду, не больше capacity в запасе"""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or max(1.0, rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    @property
+    def idle(self):
+        """Ведро полное - им давно не пользовались"""
+        self._refill()
+        return self._tokens >= self.capacity
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                self._refill()
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+class RateLimiter:
+    """Общий лимит бота плюс отдельный лимит на каждый чат"""
+
+    # При стольких вёдрах неиспользуемые выбрасываются
+    MAX_CHAT_BUCKETS = 10000
+
+    def __init__(self, global_rate=GLOBAL_RATE, per_chat_rate=PER_CHAT_RATE):
+        self.per_chat_rate = per_chat_rate
+        self._global = TokenBucket(global_rate)
+        self._chats = {}
+
+    async def acquire(self, chat_id):
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if len(self._chats) >= self.MAX_CHAT_BUCKETS:
+                self._chats = {k: b for k, b in self._chats.items() if not b.idle}
+            bucket = self._chats[chat_id] = TokenBucket(self.per_chat_rate)
+        await bucket.acquire()
+        await self._global.acquire()
+
+
+class SendMetrics:
+    """Счётчики отправки и задержки последних сообщений"""
+
+    def __init__(self, window=1000):
+        self.sent = 0
+        self.failed = 0
+        self.retries = 0
+        self.latencies = deque(maxlen=window)
+
+    def percentile(self, p):
+        if not self.latencies:
+            return 0.0
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))]
+
+
+async def send_with_retry(bot, limiter, chat_id, text, metrics=None, **kwargs):
+    """Отправка с учётом лимитов и повтором после 429 (retry_after)"""
+    delay = 1.0
+    for attempt in range(SEND_RETRIES + 1):
+        await limiter.acquire(chat_id)
+        started = time.monotonic()
+        try:
+            message = await bot.send_message(chat_id=chat_id, text=text, **kwargs)
+            if metrics:
+                metrics.sent += 1
+                metrics.latencies.append(time.monotonic() - started)
+            return message
+        except RetryAfter as e:
+            if attempt == SEND_RETRIES:
+                raise
+            logger.warning(f"Лимит Telegram для {chat_id}, ждём {e.retry_after} с")
+            await asyncio.sleep(float(e.retry_after))
+        except (Forbidden, BadRequest):
+            # Пользователь заблокировал бота или чат не существует - повтор не поможет
+            raise
+        except (TimedOut, NetworkError):
+            if attempt == SEND_RETRIES:
+                raise
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 30)
+        if metrics:
+            metrics.retries += 1
+
+
+class AdminNotifier:
+    """Рассылка новых заявок админам в фоне, не задерживая ответ пользователю"""
+
+    def __init__(self, bot, admin_ids, limiter=None, digest_threshold=NOTIFY_DIGEST_THRESHOLD):
+        self.bot = bot
+        self.admin_ids = list(admin_ids)
+        self.limiter = limiter or RateLimiter()
+        self.digest_threshold = digest_threshold
+        self.metrics = SendMetrics()
+        self._queue = asyncio.Queue()
+        self._worker = None
+
+    @property
+    def queue_depth(self):
+        return self._queue.qsize()
+
+    def summary(self):
+        m = self.metrics
+        return (
+            f"очередь {self.queue_depth}, отправлено {m.sent}, ошибок {m.failed}, повторов {m.retries}, "
+            f"задержка p50 {m.percentile(50) * 1000:.0f} мс, p99 {m.percentile(99) * 1000:.0f} мс"
+        )
+
+    def start(self):
+        if self._worker is None:
+            self._worker = asyncio.create_task(self._run())
+
+    async def stop(self, timeout=10):
+        """Дожидаемся отправки того, что уже в очереди, и останавливаем воркер"""
+        if self._worker is None:
+            return
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"Не отправлено уведомлений админам: {self._queue.qsize()}")
+        self._worker.cancel()
+        logger.info(f"Уведомления админам: {self.summary()}")
+        self._worker = None
+
+    def notify(self, text, reply_markup=None):
+        """Ставит уведомление в очередь и сразу возвращает управление"""
+        self._queue.put_nowait((text, reply_markup))
+
+    async def _run(self):
+        while True:
+            batch = [await self._queue.get()]
+            # Забираем всё, что успело накопиться, пока шла прошлая отправка
+            while not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+            try:
+                if len(batch) >= self.digest_threshold:
+                    reply_markup = batch[-1][1]
+                    for chunk in self._digest_chunks([text for text, _ in batch]):
+                        await self._fan_out(chunk, reply_markup)
+                else:
+                    for text, reply_markup in batch:
+                        await self._fan_out(text, reply_markup)
+            except Exception as e:
+                logger.error(f"Ошибка рассылки админам: {e}")
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+            logger.debug(f"Уведомления админам: {self.summary()}")
+
+    def _digest_chunks(self, texts):
+        header = f"📥 Новых заявок: {len(texts)}\n\n"
+        # Заявка обрезается так, чтобы даже вместе с заголовком влезть в одно сообщение
+        limit = MAX_MESSAGE_LENGTH - len(header) - 2
+        chunk = header
+        for text in texts:
+            text = text[:limit]
+            if len(chunk) + len(text) + 2 > MAX_MESSAGE_LENGTH and chunk != header:
+                yield chunk
+                chunk = ""
+            chunk += text + "\n\n"
+        if chunk:
+            yield chunk
+
+    async def _fan_out(self, text, reply_markup):
+        # Всем админам параллельно: 429 у одного не задерживает остальных
+        results = await asyncio.gather(
+            *(send_with_retry(self.bot, self.limiter, admin_id, text, self.metrics, reply_markup=reply_markup)
+              for admin_id in self.admin_ids),
+            return_exceptions=True,
+        )
+        for admin_id, result in zip(self.admin_ids, results):
+            if isinstance(result, Exception):
+                self.metrics.failed += 1
+                logger.error(f"Ошибка отправки админу {admin_id}: {result}")
@@ -0,0 +1,250 @@
+# persistence.py
+import os
+import json
+import time
+import sqlite3
+import asyncio
+import logging
+import threading
+
+from telegram.ext import BasePersistence, PersistenceInput
+
+logger = logging.getLogger(__name__)
+
+# Где хранить незавершённые регистрации: postgres, sqlite или none
+PERSISTENCE_BACKEND = os.environ.get('PERSISTENCE_BACKEND', '')
+PERSISTENCE_PATH = os.environ.get('PERSISTENCE_PATH', 'bot_state.sqlite3')
+# Как часто (в секундах) изменения сбрасываются в хранилище
+PERSISTENCE_INTERVAL = float(os.environ.get('PERSISTENCE_INTERVAL', '5'))
+# Черновики старше этого удаляются при запуске
+DRAFT_MAX_AGE = int(os.environ.get('DRAFT_MAX_AGE', str(7 * 24 * 3600)))
+
+# Из user_data сохраняются только поля анкеты
+DRAFT_KEYS = ('nickname', 'rank', 'name', 'contact', 'team')
+
+
+def _encode_key(key):
+    return json.dumps(list(key), separators=(',', ':'))
+
+def _decode_key(raw):
+    return tuple(json.loads(raw))
+
+def _encode_draft(data):
+    return json.dumps(data, separators=(',', ':'), ensure_ascii=False)
+
+
+class SqliteStore:
+    """Состояние в локальном файле SQLite (режим WAL)"""
+
+    def __init__(self, path):
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._lock = threading.Lock()
+
+    def setup(self, max_age):
+        with self._lock:
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS conversations (
+                    name TEXT NOT NULL,
+                    key TEXT NOT NULL,
+                    state INTEGER NOT NULL,
+                    updated_at REAL NOT NULL,
+                    PRIMARY KEY (name, key)
+                )
+            """)
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS user_drafts (
+                    user_id INTEGER PRIMARY KEY,
+                    data TEXT NOT NULL,
+                    updated_at REAL NOT NULL
+                )
+            """)
+            cutoff = time.time() - max_age
+            self._conn.execute("DELETE FROM conversations WHERE updated_at < ?", (cutoff,))
+            self._conn.execute("DELETE FROM user_drafts WHERE updated_at < ?", (cutoff,))
+
+    def load_conversations(self, name):
+        with self._lock:
+            rows = self._conn.execute("SELECT key, state FROM conversations WHERE name = ?", (name,)).fetchall()
+        return {_decode_key(key): state for key, state in rows}
+
+    def save_conversation(self, name, key, state):
+        with self._lock:
+            if state is None:
+                self._conn.execute("DELETE FROM conversations WHERE name = ? AND key = ?", (name, key))
+            else:
+                self._conn.execute("""
+                    INSERT INTO conversations (name, key, state, updated_at) VALUES (?, ?, ?, ?)
+                    ON CONFLICT (name, key) DO UPDATE SET state = excluded.state, updated_at = excluded.updated_at
+                """, (name, key, state, time.time()))
+
+    def load_drafts(self):
+        with self._lock:
+            rows = self._conn.execute("SELECT user_id, data FROM user_drafts").fetchall()
+        return {user_id: json.loads(data) for user_id, data in rows}
+
+    def save_draft(self, user_id, data):
+        with self._lock:
+            if data is None:
+                self._conn.execute("DELETE FROM user_drafts WHERE user_id = ?", (user_id,))
+            else:
+                self._conn.execute("""
+                    INSERT INTO user_drafts (user_id, data, updated_at) VALUES (?, ?, ?)
+                    ON CONFLICT (user_id) DO UPDATE SET data = excluded.data, updated_at = excluded.updated_at
+                """, (user_id, data, time.time()))
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class PostgresStore:
+    """Состояние в той же базе Postgres, что и анкеты.
+
+    Таблицы создаёт миграция 6; ready - concurrent.futures.Future, которая
+    завершается после миграций (они идут параллельно с запуском бота).
+    """
+
+    def __init__(self, ready=None):
+        from database import db_cursor
+        self._cursor = db_cursor
+        self._ready = ready
+
+    def setup(self, max_age):
+        if self._ready is not None:
+            self._ready.result()
+        with self._cursor() as cur:
+            cur.execute("DELETE FROM bot_conversations WHERE updated_at < NOW() - %s * INTERVAL '1 second'", (max_age,))
+            cur.execute("DELETE FROM bot_user_drafts WHERE updated_at < NOW() - %s * INTERVAL '1 second'", (max_age,))
+
+    def load_conversations(self, name):
+        with self._cursor() as cur:
+            cur.execute("SELECT key, state FROM bot_conversations WHERE name = %s", (name,))
+            return {_decode_key(row['key']): row['state'] for row in cur.fetchall()}
+
+    def save_conversation(self, name, key, state):
+        with self._cursor() as cur:
+            if state is None:
+                cur.execute("DELETE FROM bot_conversations WHERE name = %s AND key = %s", (name, key))
+            else:
+                cur.execute("""
+                    INSERT INTO bot_conversations (name, key, state) VALUES (%s, %s, %s)
+                    ON CONFLICT (name, key) DO UPDATE SET state = EXCLUDED.state, updated_at = CURRENT_TIMESTAMP
+                """, (name, key, state))
+
+    def load_drafts(self):
+        with self._cursor() as cur:
+            cur.execute("SELECT user_id, data FROM bot_user_drafts")
+            return {row['user_id']: json.loads(row['data']) for row in cur.fetchall()}
+
+    def save_draft(self, user_id, data):
+        with self._cursor() as cur:
+            if data is None:
+                cur.execute("DELETE FROM bot_user_drafts WHERE user_id = %s", (user_id,))
+            else:
+                cur.execute("""
+                    INSERT INTO bot_user_drafts (user_id, data) VALUES (%s, %s)
+                    ON CONFLICT (user_id) DO UPDATE SET data = EXCLUDED.data, updated_at = CURRENT_TIMESTAMP
+                """, (user_id, data))
+
+    def close(self):
+        pass
+
+
+class DraftPersistence(BasePersistence):
+    """Сохранение состояния диалогов и черновиков анкет между перезапусками.
+
+    PTB передаёт сюда только изменившиеся записи, поэтому каждое обновление -
+    это запись одной строки, а не перезапись всего состояния.
+    """
+
+    def __init__(self, store, update_interval=PERSISTENCE_INTERVAL, fallback=None):
+        """fallback - функция, создающая запасное хранилище, если store недоступно при запуске"""
+        super().__init__(
+            store_data=PersistenceInput(bot_data=False, chat_data=False, user_data=True, callback_data=False),
+            update_interval=update_interval,
+        )
+        self.store = store
+        self.fallback = fallback
+        self._setup_done = False
+
+    async def _ensure_setup(self):
+        if self._setup_done:
+            return
+        try:
+            await asyncio.to_thread(self.store.setup, DRAFT_MAX_AGE)
+        except Exception as e:
+            if self.fallback is None:
+                raise
+            # Иначе Application.initialize упадёт и бот не запустится вовсе
+            logger.error(f"❌ Хранилище состояния недоступно, используем локальное: {e}")
+            self.store = self.fallback()
+            await asyncio.to_thread(self.store.setup, DRAFT_MAX_AGE)
+        self._setup_done = True
+
+    async def get_user_data(self):
+        await self._ensure_setup()
+        return await asyncio.to_thread(self.store.load_drafts)
+
+    async def get_chat_data(self):
+        return {}
+
+    async def get_bot_data(self):
+        return {}
+
+    async def get_callback_data(self):
+        return None
+
+    async def get_conversations(self, name):
+        await self._ensure_setup()
+        return await asyncio.to_thread(self.store.load_conversations, name)
+
+    async def update_conversation(self, name, key, new_state):
+        await asyncio.to_thread(self.store.save_conversation, name, _encode_key(key), new_state)
+
+    async def update_user_data(self, user_id, data):
+        draft = {k: data[k] for k in DRAFT_KEYS if data.get(k) is not None}
+        await asyncio.to_thread(self.store.save_draft, user_id, _encode_draft(draft) if draft else None)
+
+    async def drop_user_data(self, user_id):
+        await asyncio.to_thread(self.store.save_draft, user_id, None)
+
+    async def update_chat_data(self, chat_id, data):
+        pass
+
+    async def update_bot_data(self, data):
+        pass
+
+    async def update_callback_data(self, data):
+        pass
+
+    async def drop_chat_data(self, chat_id):
+        pass
+
+    async def refresh_user_data(self, user_id, user_data):
+        pass
+
+    async def refresh_chat_data(self, chat_id, chat_data):
+        pass
+
+    async def refresh_bot_data(self, bot_data):
+        pass
+
+    async def flush(self):
+        await asyncio.to_thread(self.store.close)
+
+
+def create_persistence(database_available, database_ready=None):
+    """Выбор хранилища: по умолчанию Postgres, если он есть, иначе SQLite.
+
+    database_ready - Future окончания миграций, её дожидается хранилище в Postgres.
+    """
+    use_postgres = database_available and os.environ.get('DATABASE_URL')
+    backend = PERSISTENCE_BACKEND or ('postgres' if use_postgres else 'sqlite')
+    if backend == 'none':
+        return None
+    if backend == 'postgres':
+        # Если Postgres не отвечает при запуске, диалоги хранятся в SQLite до перезапуска
+        return DraftPersistence(PostgresStore(database_ready), fallback=lambda: SqliteStore(PERSISTENCE_PATH))
+    return DraftPersistence(SqliteStore(PERSISTENCE_PATH))
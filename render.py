@@ -0,0 +1,156 @@
+# render.py
+"""Тексты и клавиатуры админ-панели.
+
+Неизменные клавиатуры собираются один раз при импорте, страницы
+статистики и списка кэшируются по содержимому, а edit_message не
+отправляет правку, если сообщение уже выглядит так же.
+"""
+import functools
+from datetime import datetime, timedelta
+
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.error import BadRequest
+
+MAX_MESSAGE_LENGTH = 4096
+EPOCH = datetime(1970, 1, 1)
+
+# === Клавиатуры ===
+# Объекты PTB неизменяемые, поэтому одну клавиатуру можно отправлять сколько угодно раз
+BACK_BUTTON = InlineKeyboardButton("⬅️ Назад", callback_data="back_to_admin_menu")
+CANCEL_BUTTON = InlineKeyboardButton("❌ Нет, отмена", callback_data="cancel_action")
+
+ADMIN_MENU_TEXT = "👑 Админ-панель"
+ADMIN_MENU_KEYBOARD = InlineKeyboardMarkup([
+    [InlineKeyboardButton("📊 Статистика", callback_data="stats")],
+    [InlineKeyboardButton("📋 Все участники", callback_data="list_all")],
+    [InlineKeyboardButton("🗑 Удалить профиль", callback_data="delete_profile")],
+    [InlineKeyboardButton("🏁 Закрыть турнир", callback_data="reset_all")],
+])
+BACK_KEYBOARD = InlineKeyboardMarkup([[BACK_BUTTON]])
+OPEN_LIST_KEYBOARD = InlineKeyboardMarkup([
+    [InlineKeyboardButton("📋 Все участники", callback_data="list_all")],
+    [BACK_BUTTON],
+])
+CONFIRM_DELETE_KEYBOARD = InlineKeyboardMarkup([
+    [InlineKeyboardButton("✅ Да, удалить", callback_data="confirm_delete")],
+    [CANCEL_BUTTON],
+    [BACK_BUTTON],
+])
+CONFIRM_RESET_KEYBOARD = InlineKeyboardMarkup([
+    [InlineKeyboardButton("✅ Да, закрыть турнир", callback_data="confirm_reset")],
+    [CANCEL_BUTTON],
+    [BACK_BUTTON],
+])
+CONFIRM_BROADCAST_KEYBOARD = InlineKeyboardMarkup([
+    [InlineKeyboardButton("✅ Отправить", callback_data="broadcast_confirm")],
+    [InlineKeyboardButton("❌ Нет, отмена", callback_data="broadcast_cancel")],
+])
+# Кнопка под уведомлением о новой заявке
+NOTIFY_KEYBOARD = InlineKeyboardMarkup([
+    [InlineKeyboardButton("⚙️ Админ-меню", callback_data="back_to_admin_menu")],
+])
+
+
+# === Шаблоны ===
+STATS_HEADER = "📊 Статистика\nВсего: {total}\n"
+STATS_TEAM = "  {team}: {count}\n"
+LIST_HEADER = "📋 Участники:\n"
+# ID из БД в скобках для ясности, имя и контакт - на отдельной строке
+LIST_ROW = "{num}. #{id} {nickname} ({rank})\n   Имя: {name}, Контакт: {contact}\n"
+
+
+def truncate(message, limit=MAX_MESSAGE_LENGTH):
+    if len(message) > limit:
+        return message[:limit - 1] + "…"
+    return message
+
+
+@functools.lru_cache(maxsize=64)
+def _render_stats(total, teams):
+    parts = [STATS_HEADER.format(total=total)]
+    if teams:
+        parts.append("Команды:\n")
+        parts.extend(STATS_TEAM.format(team=team, count=count) for team, count in teams)
+    else:
+        parts.append("Нет команд.")
+    return truncate("".join(parts))
+
+def render_stats(total, teams):
+    """Текст статистики; одинаковые цифры отдаются из кэша"""
+    return _render_stats(total, tuple((t['team'], t['count']) for t in teams))
+
+
+# Курсор (created_at, id) кодируется в callback_data: "list_next:<номер>:<мкс>:<id>"
+def encode_page_callback(direction, start_num, created_at, app_id):
+    micros = (created_at - EPOCH) // timedelta(microseconds=1)
+    return f"list_{direction}:{start_num}:{micros}:{app_id}"
+
+def decode_page_callback(data):
+    direction, start_num, micros, app_id = data.split(":")
+    cursor = (EPOCH + timedelta(microseconds=int(micros)), int(app_id))
+    return direction == "list_prev", int(start_num), cursor
+
+
+@functools.lru_cache(maxsize=256)
+def _render_list_page(rows, start_num, has_prev, has_next):
+    if not rows:
+        message = "📭 Нет заявок."
+    else:
+        parts = [LIST_HEADER]
+        for num, (app_id, nickname, rank, name, contact, _) in enumerate(rows, start_num):
+            parts.append(LIST_ROW.format(
+                num=num, id=app_id, nickname=nickname, rank=rank,
+                name=name or "Не указано", contact=contact or "Не указан",
+            ))
+        message = truncate("".join(parts))
+
+    nav = []
+    if has_prev:
+        first = rows[0]
+        nav.append(InlineKeyboardButton("◀️", callback_data=encode_page_callback("prev", start_num, first[5], first[0])))
+    if has_next:
+        last = rows[-1]
+        next_num = start_num + len(rows)
+        nav.append(InlineKeyboardButton("▶️", callback_data=encode_page_callback("next", next_num, last[5], last[0])))
+    if not nav:
+        return message, BACK_KEYBOARD
+    return message, InlineKeyboardMarkup([nav, [BACK_BUTTON]])
+
+def render_list_page(apps, start_num, has_prev, has_next):
+    """Текст и клавиатура страницы списка участников; повторный показ той же страницы берётся из кэша"""
+    rows = tuple(
+        (app['id'], app['nickname'], app['rank'], app['name'], app['contact'], app['created_at'])
+        for app in apps
+    )
+    return _render_list_page(rows, start_num, has_prev, has_next)
+
+
+# === Отправка ===
+def is_unchanged(message, text, reply_markup):
+    """Сообщение уже показывает этот текст и эти кнопки"""
+    if message is None or message.text is None:
+        return False
+    # Telegram обрезает пробелы по краям текста
+    if message.text != text.strip():
+        return False
+    current = message.reply_markup
+    if reply_markup is None or current is None:
+        # Пустая клавиатура и её отсутствие выглядят одинаково
+        return not (reply_markup and reply_markup.inline_keyboard) and not (current and current.inline_keyboard)
+    return current == reply_markup
+
+async def edit_message(query, text, reply_markup=None):
+    """edit_message_text без запроса к Telegram, если сообщение не изменилось.
+
+    Возвращает False, если правка не понадобилась.
+    """
+    if is_unchanged(query.message, text, reply_markup):
+        return False
+    try:
+        await query.edit_message_text(text, reply_markup=reply_markup)
+    except BadRequest as e:
+        # Сообщение успели изменить так же из другого обработчика
+        if "message is not modified" in str(e).lower():
+            return False
+        raise
+    return True
@@ -0,0 +1,101 @@
+# search_index.py
+import threading
+
+from dedup import normalize_key
+
+# Минимальная доля совпавших триграмм запроса, чтобы запись попала в выдачу
+SEARCH_MIN_SCORE = 0.3
+SEARCH_FIELDS = ('nickname', 'name', 'contact', 'team')
+
+
+def search_document(row):
+    """Текст для поиска: все поля анкеты в нижнем регистре (как в индексе Postgres)"""
+    return " ".join((row.get(field) or "") for field in SEARCH_FIELDS).lower()
+
+
+def trigrams(text):
+    """Триграммы каждого слова с пробелами по краям, как в pg_trgm"""
+    grams = set()
+    for word in text.lower().split():
+        padded = f"  {word} "
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+
+class SearchIndex:
+    """Триграммный индекс анкет в памяти для /find, когда БД нет или она недоступна.
+
+    Записи хранятся по ключу ник+контакт, как и дубли в БД: повторная
+    заявка заменяет прежнюю.
+    """
+
+    def __init__(self, min_score=SEARCH_MIN_SCORE):
+        self.min_score = min_score
+        self._rows = {}  # ключ -> анкета
+        self._documents = {}  # ключ -> текст для поиска
+        self._postings = {}  # триграмма -> множество ключей
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._rows)
+
+    def _remove(self, key):
+        self._rows.pop(key, None)
+        document = self._documents.pop(key, None)
+        if document is None:
+            return
+        for gram in trigrams(document):
+            keys = self._postings.get(gram)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._postings[gram]
+
+    def add(self, row):
+        key = normalize_key(row['nickname'], row['contact'])
+        document = search_document(row)
+        with self._lock:
+            self._remove(key)
+            self._rows[key] = dict(row)
+            self._documents[key] = document
+            for gram in trigrams(document):
+                self._postings.setdefault(gram, set()).add(key)
+
+    def remove_ids(self, app_ids):
+        app_ids = set(app_ids)
+        with self._lock:
+            for key in [k for k, row in self._rows.items() if row.get('id') in app_ids]:
+                self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._rows.clear()
+            self._documents.clear()
+            self._postings.clear()
+
+    def get(self, app_id):
+        with self._lock:
+            for row in self._rows.values():
+                if row.get('id') == app_id:
+                    return dict(row)
+        return None
+
+    def search(self, query, limit=10):
+        """Анкеты, отсортированные по убыванию схожести с запросом"""
+        query = query.strip().lower()
+        grams = trigrams(query)
+        if not grams:
+            return []
+        with self._lock:
+            hits = {}
+            for gram in grams:
+                for key in self._postings.get(gram, ()):
+                    hits[key] = hits.get(key, 0) + 1
+            scored = []
+            for key, count in hits.items():
+                # Подстрока целиком - лучшее совпадение, иначе доля общих триграмм
+                score = 1.0 if query in self._documents[key] else count / len(grams)
+                if score >= self.min_score:
+                    scored.append((score, key))
+            scored.sort(key=lambda item: (-item[0], -(self._rows[item[1]].get('id') or 0)))
+            return [dict(self._rows[key], score=score) for score, key in scored[:limit]]
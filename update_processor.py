@@ -0,0 +1,57 @@
+# update_processor.py
+import asyncio
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    """Апдейты разных пользователей обрабатываются параллельно, одного - по очереди.
+
+    ConversationHandler и user_data не рассчитаны на два апдейта одного
+    пользователя сразу: при двойной отправке или быстрых ответах они
+    гонялись бы за состояние диалога и черновик анкеты.
+    """
+
+    def __init__(self, max_concurrent_updates):
+        super().__init__(max_concurrent_updates)
+        self._locks = {}  # ID пользователя -> [замок, сколько апдейтов его держат или ждут]
+
+    @staticmethod
+    def _user_id(update):
+        if isinstance(update, Update) and update.effective_user:
+            return update.effective_user.id
+        return None
+
+    async def process_update(self, update, coroutine):
+        # В BaseUpdateProcessor сначала берётся общий семафор. Апдейты одного
+        # пользователя, ждущие его замка, занимали бы слоты параллельности и
+        # при двойном нажатии или долгой /export задерживали бы всех остальных.
+        # Поэтому сначала замок пользователя, а слот - только когда его очередь
+        user_id = self._user_id(update)
+        if user_id is None:
+            async with self._semaphore:
+                await self.do_process_update(update, coroutine)
+            return
+        entry = self._locks.get(user_id)
+        if entry is None:
+            entry = self._locks[user_id] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                async with self._semaphore:
+                    await self.do_process_update(update, coroutine)
+        finally:
+            # Замок нужен, только пока у пользователя есть апдейты в работе
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._locks[user_id]
+
+    async def do_process_update(self, update, coroutine):
+        await coroutine
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
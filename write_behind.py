@@ -0,0 +1,177 @@
+# write_behind.py
+import os
+import json
+import time
+import uuid
+import asyncio
+import logging
+
+from database import run_db, save_applications_checked
+
+logger = logging.getLogger(__name__)
+
+# Отложенная запись анкет пачками (включается WRITE_BEHIND=1)
+WRITE_BEHIND_ENABLED = os.environ.get('WRITE_BEHIND', '0') == '1'
+WRITE_BEHIND_BATCH_SIZE = int(os.environ.get('WRITE_BEHIND_BATCH_SIZE', '50'))
+# Сколько миллисекунд ждать, пока наберётся пачка
+WRITE_BEHIND_FLUSH_MS = int(os.environ.get('WRITE_BEHIND_FLUSH_MS', '50'))
+WRITE_BEHIND_JOURNAL = os.environ.get('WRITE_BEHIND_JOURNAL', 'applications.journal')
+# Сколько секунд save() ждёт запись пачки, прежде чем сдаться
+WRITE_BEHIND_TIMEOUT = float(os.environ.get('WRITE_BEHIND_TIMEOUT', '30'))
+
+
+class Journal:
+    """Журнал на диске: строка "add" на каждую анкету и "done" после записи в БД"""
+
+    def __init__(self, path):
+        self.path = path
+        self._file = None
+
+    def open(self):
+        """Открытие журнала, возвращает анкеты, не дошедшие до БД"""
+        pending = {}
+        if os.path.exists(self.path):
+            with open(self.path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # Недописанная строка после падения
+                        continue
+                    if record['op'] == 'add':
+                        pending[record['key']] = tuple(record['row'])
+                    elif record['op'] == 'done':
+                        for key in record['keys']:
+                            pending.pop(key, None)
+        self._file = open(self.path, "a", encoding="utf-8")
+        return pending
+
+    def _write(self, record):
+        self._file.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self._file.flush()
+
+    def add(self, key, row):
+        self._write({'op': 'add', 'key': key, 'row': list(row)})
+
+    def done(self, keys):
+        self._write({'op': 'done', 'keys': keys})
+
+    def sync(self):
+        os.fsync(self._file.fileno())
+
+    def truncate(self):
+        """Все анкеты в БД - журнал можно начать заново"""
+        self._file.truncate(0)
+        self._file.seek(0)
+
+    def close(self):
+        if self._file:
+            self._file.close()
+            self._file = None
+
+
+class WriteBehindQueue:
+    """Очередь анкет, которые пишутся в БД пачками каждые N строк или M мс"""
+
+    def __init__(self, journal_path=WRITE_BEHIND_JOURNAL, batch_size=WRITE_BEHIND_BATCH_SIZE,
+                 flush_ms=WRITE_BEHIND_FLUSH_MS, save_timeout=WRITE_BEHIND_TIMEOUT):
+        self.journal = Journal(journal_path)
+        self.batch_size = batch_size
+        self.flush_interval = flush_ms / 1000
+        self.save_timeout = save_timeout
+        self._queue = asyncio.Queue()
+        self._unflushed = 0  # анкеты из журнала, ещё не записанные в БД
+        self._flusher = None
+
+    async def start(self):
+        pending = self.journal.open()
+        if pending:
+            # Дописываем то, что не успели сохранить до падения
+            logger.info(f"Восстановление анкет из журнала: {len(pending)}")
+            keys = list(pending)
+            for i in range(0, len(keys), self.batch_size):
+                chunk = keys[i:i + self.batch_size]
+                results = await run_db(save_applications_checked, [pending[key] for key in chunk])
+                # Строку, которую БД не принимает, повторять бесполезно - она уходит из журнала в лог
+                for key, result in zip(chunk, results):
+                    if isinstance(result, Exception):
+                        logger.error(f"Анкета из журнала отклонена БД: {pending[key]}: {result}")
+                self.journal.done(chunk)
+        self.journal.truncate()
+        self._flusher = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Запись оставшихся анкет и остановка"""
+        if self._flusher is None:
+            return
+        await self._queue.join()
+        self._flusher.cancel()
+        self._flusher = None
+        self.journal.close()
+
+    async def save(self, nickname, rank, name, contact, team, user_id=None):
+        """Постановка анкеты в очередь, возвращает ID после записи пачки.
+
+        Если пачка не записана за save_timeout секунд, бросает asyncio.TimeoutError;
+        анкета при этом остаётся в очереди и журнале.
+        """
+        row = (nickname, rank, name, contact, team, user_id)
+        key = uuid.uuid4().hex
+        self.journal.add(key, row)
+        self._unflushed += 1
+        future = asyncio.get_running_loop().create_future()
+        # Ошибка пачки читается, даже если save() уже перестал ждать по таймауту
+        future.add_done_callback(lambda f: f.cancelled() or f.exception())
+        self._queue.put_nowait((key, row, future))
+        return await asyncio.wait_for(asyncio.shield(future), self.save_timeout)
+
+    async def _collect(self):
+        batch = [await self._queue.get()]
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self):
+        while True:
+            batch = await self._collect()
+            try:
+                await self._flush(batch)
+            except Exception as e:
+                # Задача не должна умереть: иначе все следующие save() ждали бы до таймаута
+                logger.error(f"Ошибка очереди пакетной записи: {e}")
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    async def _flush(self, batch):
+        try:
+            # Журнал сбрасывается на диск один раз на пачку
+            await asyncio.to_thread(self.journal.sync)
+            results = await run_db(save_applications_checked, [row for _, row, _ in batch])
+        except Exception as e:
+            # Анкеты остаются в журнале и будут записаны при следующем запуске
+            logger.error(f"Ошибка пакетной записи анкет: {e}")
+            for _, _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        # Сначала отвечаем ожидающим, потом ведём журнал: его ошибка не должна их задержать.
+        # Отклонённая БД строка получает свою ошибку и из журнала тоже уходит
+        for (_, _, future), result in zip(batch, results):
+            if future.done():
+                continue
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+        self.journal.done([key for key, _, _ in batch])
+        self._unflushed -= len(batch)
+        if self._unflushed == 0:
+            self.journal.truncate()